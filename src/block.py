@@ -18,6 +18,15 @@ LOWEST_BITS = bytes.fromhex("ffff001d")
 
 
 class Block:
+    __slots__ = (
+        "version",
+        "prev_block",
+        "merkle_root",
+        "timestamp",
+        "bits",
+        "nonce",
+        "tx_hashes",
+    )
 
     def __init__(
         self, version, prev_block, merkle_root, timestamp, bits, nonce, tx_hashes=None
@@ -67,6 +76,12 @@ class Block:
         result += self.nonce
         return result
 
+    def serialize_into(self, buf):
+        """Appends the 80 byte block header to the bytearray buf and
+        returns buf, so the transactions can follow with Tx.serialize_into"""
+        buf += self.serialize()
+        return buf
+
     def hash(self):
         """Returns the hash256 interpreted little endian of the block"""
         # serialize
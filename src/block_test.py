@@ -30,6 +30,9 @@ class TestBlock:
         stream = io.BytesIO(block_raw)
         block = Block.parse(stream)
         assert block.serialize() == block_raw
+        buf = bytearray(b"\x00")
+        assert block.serialize_into(buf) is buf
+        assert buf == b"\x00" + block_raw
 
     def test_hash(self):
         block_raw = bytes.fromhex(
@@ -5,8 +5,10 @@ File to implement the Elliptic Curve Cryptography presents in the book
 
 import hmac
 import hashlib
-from helper import hash160, encode_base58_checksum
+from collections import OrderedDict
+from helper import hash160, encode_base58_checksum, tagged_hash
 import io
+import os
 
 
 class FieldElement:
@@ -157,9 +159,19 @@ class S256Field(FieldElement):
     def sqrt(self):
         return self ** ((P + 1) // 4)
 
+    @classmethod
+    def batch_inverse(cls, elements):
+        """Returns the inverses of all the elements with one exponentiation
+        and 3 multiplications per element (Montgomery's trick)"""
+        nums = _batch_inverse([element.num for element in elements], P)
+        return [cls(num) for num in nums]
+
 
 class S256Point(Point):
 
+    # split scalars with the GLV endomorphism in __rmul__ and verify
+    use_glv = True
+
     def __init__(self, x, y, a=None, b=None):
         a, b = S256Field(A), S256Field(B)
         if type(x) == int:
@@ -167,6 +179,29 @@ class S256Point(Point):
         else:
             super().__init__(x, y, a, b)
 
+    @classmethod
+    def _from_ints(cls, x, y):
+        """Builds the point from coordinates that are already known to be
+        on the curve, skipping the check in Point.__init__"""
+        point = cls.__new__(cls)
+        point.a = S256Field(A)
+        point.b = S256Field(B)
+        point.x = S256Field(x)
+        point.y = S256Field(y)
+        return point
+
+    @classmethod
+    def _batch_normalize(cls, points):
+        """Converts a list of _JacobianPoints to S256Points with a single
+        field inversion for the whole list"""
+        result = []
+        for point in _JacobianPoint.batch_normalize(points):
+            if point.is_infinity():
+                result.append(cls(None, None))
+            else:
+                result.append(cls._from_ints(point.x, point.y))
+        return result
+
     def __repr__(self):
         if self.x is None:
             return "S256Point(infinity)"
@@ -175,7 +210,35 @@ class S256Point(Point):
 
     def __rmul__(self, coefficient):
         coef = coefficient % N
-        return super().__rmul__(coef)
+        if self == G:
+            # multiples of the generator come from the precomputed table
+            return GeneratorTable.multiply(coef).to_affine()
+        # work in Jacobian coordinates and invert only once at the end
+        return _multiply(coef, _JacobianPoint.from_affine(self)).to_affine()
+
+    @classmethod
+    def recover(cls, z, sig):
+        """
+        Returns the public keys (at most two) for which sig is a valid
+        signature of z, that is exactly the points P with P.verify(z, sig).
+
+        R is one of the two points with x = r, and P = (s*R - z*G) / r.
+        The two candidates only differ in the sign of the s/r * R term, so
+        that product is computed once.
+        """
+        # s is taken mod N, as verify does
+        r, s = sig.r, sig.s % N
+        if s == 0 or r >= P or r % N == 0:
+            return []
+        # y^2 = r^3 + 7 must have a solution for R to exist
+        alpha = (pow(r, 3, P) + B) % P
+        beta = pow(alpha, (P + 1) // 4, P)
+        if beta * beta % P != alpha:
+            return []
+        r_inv = pow(r, N - 2, N)
+        a = _multiply(s * r_inv % N, _JacobianPoint(r, beta, 1))
+        b = GeneratorTable.multiply(-z * r_inv % N)
+        return [p for p in cls._batch_normalize([b + a, b + -a]) if p.x is not None]
 
     def verify(self, z, sig):
         # By Fermat's Little Theorem, 1/s = pow(s, N-2, N)
@@ -184,14 +247,39 @@ class S256Point(Point):
         u = z * s_inv % N
         # v = r / s
         v = sig.r * s_inv % N
-        # u*G + v*P should have as the x coordinate, r
-        total = u * G + v * self
-        return total.x.num == sig.r
+        return self._verify_scalars(u, v, sig.r, self._verify_tables())
+
+    def _verify_tables(self):
+        """Returns the lookup tables verify needs for v * self"""
+        tables = HotKeyTables.get(self)
+        if tables is not None:
+            return tables
+        multiples = _odd_multiples(_JacobianPoint.from_affine(self), NAF_WINDOW)
+        if self.use_glv:
+            return multiples, _endomorphism_multiples(multiples)
+        return multiples, None
+
+    def _verify_scalars(self, u, v, r, tables):
+        """Checks that u*G + v*self has r as its x coordinate"""
+        # both products share one doubling chain in Jacobian coordinates
+        g_multiples = GeneratorTable.get_odd_multiples()
+        multiples, endomorphism_multiples = tables
+        if self.use_glv:
+            # four ~128-bit terms instead of two 256-bit ones
+            g_endo = GeneratorTable.get_endomorphism_multiples()
+            terms = _glv_terms(u, g_multiples, g_endo)
+            terms += _glv_terms(v, multiples, endomorphism_multiples)
+        else:
+            terms = [(u, g_multiples), (v, multiples)]
+        total = _multi_multiply(terms)
+        if total.is_infinity() or r >= P:
+            return False
+        # the affine x is X / Z^2, so compare without inverting Z
+        return total.x == r * total.z * total.z % P
 
     def sec(self, compressed=True):
         """returns the binary version of the SEC format"""
         if compressed:
-            print(self.y.num, self.y.num % 2)
             if self.y.num % 2 == 0:
                 return b"\x02" + self.x.num.to_bytes(32, "big")
             else:
@@ -203,6 +291,44 @@ class S256Point(Point):
                 + self.y.num.to_bytes(32, "big")
             )
 
+    def xonly(self):
+        """returns the 32-byte x-only public key of BIP340"""
+        return self.x.num.to_bytes(32, "big")
+
+    @classmethod
+    def parse_xonly(cls, xonly_bin):
+        """returns the point with even y for a BIP340 x-only public key"""
+        if len(xonly_bin) != 32:
+            raise ValueError("x-only public key must be 32 bytes")
+        return cls.parse(b"\x02" + xonly_bin)
+
+    def verify_schnorr(self, msg, sig):
+        """Verifies a BIP340 SchnorrSignature of msg (bytes) for the x-only
+        public key of this point"""
+        if sig.r >= P or sig.s >= N:
+            return False
+        xonly = self.xonly()
+        e = _schnorr_challenge(sig.r.to_bytes(32, "big"), xonly, msg)
+        # the x-only key stands for the point with even y
+        if self.y.num % 2 == 0:
+            point = _JacobianPoint.from_affine(self)
+        else:
+            point = -_JacobianPoint.from_affine(self)
+        # R = s*G - e*P must have even y and x = r
+        g_multiples = GeneratorTable.get_odd_multiples()
+        multiples = _odd_multiples(point, NAF_WINDOW)
+        if self.use_glv:
+            terms = _glv_terms(
+                sig.s, g_multiples, GeneratorTable.get_endomorphism_multiples()
+            )
+            terms += _glv_terms(-e % N, multiples, _endomorphism_multiples(multiples))
+        else:
+            terms = [(sig.s, g_multiples), (-e % N, multiples)]
+        total = _multi_multiply(terms).normalize()
+        if total.is_infinity():
+            return False
+        return total.y % 2 == 0 and total.x == sig.r
+
     @classmethod
     def parse(self, sec_bin):
         """returns a Point object from a SEC binary (not hex)"""
@@ -211,17 +337,18 @@ class S256Point(Point):
             y = int.from_bytes(sec_bin[33:65], "big")
             return S256Point(x=x, y=y)
         is_even = sec_bin[0] == 2
-        x = S256Field(int.from_bytes(sec_bin[1:], "big"))
+        x = int.from_bytes(sec_bin[1:], "big")
         # right side of the equation y^2 = x^3 + 7
-        alpha = x**3 + S256Field(B)
-        # solve for left side
-        beta = alpha.sqrt()
-        if beta.num % 2 == 0:
+        alpha = (pow(x, 3, P) + B) % P
+        # solve for left side, the same as S256Field.sqrt on plain ints
+        beta = pow(alpha, (P + 1) // 4, P)
+        if beta % 2 == 0:
             even_beta = beta
-            odd_beta = S256Field(P - beta.num)
+            odd_beta = P - beta
         else:
-            even_beta = S256Field(P - beta.num)
+            even_beta = P - beta
             odd_beta = beta
+        # S256Point checks that x was really on the curve
         if is_even:
             return S256Point(x, even_beta)
         else:
@@ -240,12 +367,659 @@ class S256Point(Point):
         return encode_base58_checksum(prefix + h160)
 
 
+def _batch_inverse(nums, modulus):
+    """
+    Inverts every number modulo a prime with a single modular
+    exponentiation (Montgomery's trick): invert the product of all the
+    numbers once, then peel the individual inverses off it with
+    multiplications. Raises ZeroDivisionError if any of them is 0.
+    """
+    prefixes = []
+    product = 1
+    for num in nums:
+        prefixes.append(product)
+        product = product * num % modulus
+    if product == 0:
+        # one 0 would turn every inverse into 0
+        raise ZeroDivisionError("0 has no inverse")
+    inverse = pow(product, modulus - 2, modulus)
+    result = [0] * len(nums)
+    for i in range(len(nums) - 1, -1, -1):
+        # inverse is now 1 / (nums[0] * ... * nums[i])
+        result[i] = prefixes[i] * inverse % modulus
+        inverse = inverse * nums[i] % modulus
+    return result
+
+
+class _JacobianPoint:
+    """
+    Internal representation of a secp256k1 point in Jacobian coordinates.
+
+    The triple (X, Y, Z) stands for the affine point (X/Z^2, Y/Z^3), so
+    additions and doublings need no field inversion. The only inversion
+    happens in to_affine(), once at the end of a scalar multiplication.
+    The point at infinity is any triple with Z = 0.
+
+    Coordinates are plain ints reduced modulo P rather than S256Field
+    objects, and __slots__ keeps each instance small, so the hot loops
+    allocate as little as possible.
+    """
+
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __repr__(self):
+        return "_JacobianPoint({:x}, {:x}, {:x})".format(self.x, self.y, self.z)
+
+    def __eq__(self, other):
+        # (X1, Y1, Z1) and (X2, Y2, Z2) are the same point when
+        # X1 * Z2^2 = X2 * Z1^2 and Y1 * Z2^3 = Y2 * Z1^3
+        if self.is_infinity() or other.is_infinity():
+            return self.is_infinity() and other.is_infinity()
+        z1_2 = self.z * self.z % P
+        z2_2 = other.z * other.z % P
+        return (
+            self.x * z2_2 % P == other.x * z1_2 % P
+            and self.y * z2_2 * other.z % P == other.y * z1_2 * self.z % P
+        )
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    @classmethod
+    def infinity(cls):
+        return cls(1, 1, 0)
+
+    @classmethod
+    def from_affine(cls, point):
+        if point.x is None:
+            return cls.infinity()
+        return cls(point.x.num, point.y.num, 1)
+
+    def normalize(self):
+        """Returns the same point scaled to Z = 1 (one field inversion)"""
+        if self.is_infinity():
+            return self
+        z_inv = pow(self.z, P - 2, P)
+        z_inv_2 = z_inv * z_inv % P
+        return self.__class__(
+            self.x * z_inv_2 % P, self.y * z_inv_2 * z_inv % P, 1
+        )
+
+    @classmethod
+    def batch_normalize(cls, points):
+        """Scales every point to Z = 1 like normalize(), sharing one field
+        inversion across the whole list"""
+        z_invs = iter(_batch_inverse([p.z for p in points if p.z != 0], P))
+        result = []
+        for point in points:
+            if point.z == 0:
+                result.append(point)
+                continue
+            z_inv = next(z_invs)
+            z_inv_2 = z_inv * z_inv % P
+            result.append(
+                cls(point.x * z_inv_2 % P, point.y * z_inv_2 * z_inv % P, 1)
+            )
+        return result
+
+    def to_affine(self):
+        if self.is_infinity():
+            return S256Point(None, None)
+        point = self.normalize()
+        return S256Point._from_ints(point.x, point.y)
+
+    def is_infinity(self):
+        return self.z == 0
+
+    def double(self):
+        # dbl-2009-l from the Explicit-Formulas Database (valid for a = 0)
+        x1, y1, z1 = self.x, self.y, self.z
+        if z1 == 0 or y1 == 0:
+            return self.infinity()
+        a = x1 * x1 % P
+        b = y1 * y1 % P
+        c = b * b % P
+        d = x1 + b
+        d = 2 * (d * d - a - c) % P
+        e = 3 * a % P
+        x = (e * e - 2 * d) % P
+        y = (e * (d - x) - 8 * c) % P
+        z = 2 * y1 * z1 % P
+        return self.__class__(x, y, z)
+
+    def __neg__(self):
+        return self.__class__(self.x, (P - self.y) % P, self.z)
+
+    def __add__(self, other):
+        if self.z == 0:
+            return other
+        if other.z == 0:
+            return self
+        if other.z == 1:
+            return self.add_affine(other)
+        z1_2 = self.z * self.z % P
+        z2_2 = other.z * other.z % P
+        u1 = self.x * z2_2 % P
+        u2 = other.x * z1_2 % P
+        s1 = self.y * z2_2 * other.z % P
+        s2 = other.y * z1_2 * self.z % P
+        if u1 == u2:
+            # same x coordinate: either the same point or inverses
+            if s1 != s2:
+                return self.infinity()
+            return self.double()
+        h = u2 - u1
+        r = s2 - s1
+        h_2 = h * h % P
+        h_3 = h_2 * h % P
+        u1_h_2 = u1 * h_2 % P
+        x = (r * r - h_3 - 2 * u1_h_2) % P
+        y = (r * (u1_h_2 - x) - s1 * h_3) % P
+        z = h * self.z * other.z % P
+        return self.__class__(x, y, z)
+
+    def add_affine(self, point):
+        """Mixed addition with a point that has Z = 1"""
+        if point.z == 0:
+            return self
+        if self.z == 0:
+            return point
+        x1, y1, z1 = self.x, self.y, self.z
+        z1_2 = z1 * z1 % P
+        u2 = point.x * z1_2 % P
+        s2 = point.y * z1_2 * z1 % P
+        if x1 == u2:
+            if y1 != s2:
+                return self.infinity()
+            return self.double()
+        h = u2 - x1
+        r = s2 - y1
+        h_2 = h * h % P
+        h_3 = h_2 * h % P
+        u1_h_2 = x1 * h_2 % P
+        x = (r * r - h_3 - 2 * u1_h_2) % P
+        y = (r * (u1_h_2 - x) - y1 * h_3) % P
+        z = h * z1 % P
+        return self.__class__(x, y, z)
+
+    def __rmul__(self, coefficient):
+        coef = coefficient
+        current = self
+        result = self.infinity()
+        while coef:
+            if coef & 1:
+                result += current
+            current = current.double()
+            coef >>= 1
+        return result
+
+
+NAF_WINDOW = 5
+
+
+def _wnaf(coefficient, width):
+    """Returns the width-w non-adjacent form of coefficient, least
+    significant digit first. Every non-zero digit is odd and smaller
+    than 2^(width-1) in absolute value."""
+    digits = []
+    coef = coefficient
+    while coef:
+        if coef & 1:
+            digit = coef & ((1 << width) - 1)
+            if digit >= 1 << (width - 1):
+                digit -= 1 << width
+            coef -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        coef >>= 1
+    return digits
+
+
+def _odd_multiples(point, width):
+    """Returns [P, 3P, 5P, ..., (2^(width-1) - 1)P] for a _JacobianPoint P,
+    the lookup table for a width-w NAF"""
+    double = point.double()
+    multiples = [point]
+    for _ in range((1 << (width - 2)) - 1):
+        multiples.append(multiples[-1] + double)
+    return multiples
+
+
+def _multi_multiply(terms):
+    """
+    Computes the sum of coefficient * P over (coefficient, odd_multiples)
+    terms, where odd_multiples comes from _odd_multiples(P, width).
+    Coefficients may be negative.
+
+    This is the Strauss-Shamir trick with interleaved wNAF: all the terms
+    share a single doubling chain, and each term only adds a table entry
+    when its own NAF digit is non-zero. Returns a _JacobianPoint.
+    """
+    nafs = []
+    for coefficient, multiples in terms:
+        # the table has 2^(width-2) entries
+        width = len(multiples).bit_length() + 1
+        if coefficient < 0:
+            naf = [-digit for digit in _wnaf(-coefficient, width)]
+        else:
+            naf = _wnaf(coefficient, width)
+        nafs.append((naf, multiples))
+    result = _JacobianPoint.infinity()
+    for i in range(max(len(naf) for naf, _ in nafs) - 1, -1, -1):
+        result = result.double()
+        for naf, multiples in nafs:
+            if i < len(naf) and naf[i]:
+                digit = naf[i]
+                if digit > 0:
+                    result = result + multiples[digit >> 1]
+                else:
+                    result = result + -multiples[-digit >> 1]
+    return result
+
+
+# secp256k1 has the endomorphism phi(x, y) = (BETA * x, y), which acts on
+# the group as multiplication by LAMBDA
+BETA = 0x7AE96A2B657C07106E64479EAC3434E99CF0497512F58995C1396C28719501EE
+LAMBDA = 0x5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72
+# short basis of the lattice {(a, b): a + b * LAMBDA = 0 mod N}
+GLV_A1 = 0x3086D221A7D46BCDE86C90E49284EB15
+GLV_B1 = -0xE4437ED6010E88286F547FA90ABFE4C3
+GLV_A2 = 0x114CA50F7A8E2F3F657C1108D9D44CFD8
+GLV_B2 = GLV_A1
+
+
+def _glv_split(coefficient):
+    """Returns (k1, k2) with k1 + k2 * LAMBDA = coefficient mod N, where
+    both halves are about 128 bits long (and may be negative)"""
+    c1 = (GLV_B2 * coefficient + N // 2) // N
+    c2 = (-GLV_B1 * coefficient + N // 2) // N
+    k1 = coefficient - c1 * GLV_A1 - c2 * GLV_A2
+    k2 = -c1 * GLV_B1 - c2 * GLV_B2
+    return k1, k2
+
+
+def _endomorphism_multiples(multiples):
+    """Applies phi to every point of an odd multiples table. In Jacobian
+    coordinates phi only multiplies X by BETA."""
+    return [_JacobianPoint(BETA * p.x % P, p.y, p.z) for p in multiples]
+
+
+def _glv_terms(coefficient, multiples, endomorphism_multiples):
+    """Turns coefficient * P into the two _multi_multiply terms
+    k1 * P + k2 * phi(P)"""
+    k1, k2 = _glv_split(coefficient)
+    return [(k1, multiples), (k2, endomorphism_multiples)]
+
+
+def _multiply(coefficient, point):
+    """Returns coefficient * point for a _JacobianPoint, through the GLV
+    split when S256Point.use_glv is set"""
+    if S256Point.use_glv:
+        multiples = _odd_multiples(point, NAF_WINDOW)
+        terms = _glv_terms(coefficient, multiples, _endomorphism_multiples(multiples))
+        return _multi_multiply(terms)
+    return coefficient * point
+
+
 G = S256Point(
     0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
     0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8,
 )
 
 
+# sha256 of the file GeneratorTable.dump() writes, by window size
+GENERATOR_TABLE_DIGESTS = {
+    4: "e3d9566c2ba221ce652f19de2f4cf0577b45321fe75b7aa197820aee14ee76d4",
+    8: "cc31c7473a186f27804bc87cb9cce5674ffef011cedef9b28be2aa2aca2af353",
+}
+
+
+class GeneratorTable:
+    """
+    Precomputed multiples of the generator point G.
+
+    The scalar is split into digits of `window` bits. Row i of the table
+    holds d * 2^(window * i) * G for every non-zero digit d, so k*G needs
+    one mixed addition per non-zero digit and no doublings at all.
+    The table is built on first use, or can be loaded from a file written
+    by dump() to skip the build.
+
+    It also keeps the odd multiples of G used by the wider NAF window in
+    signature verification, built on first use as well.
+    """
+
+    window = 4
+    table = None
+    naf_window = 8
+    odd_multiples = None
+    endomorphism_multiples = None
+
+    @classmethod
+    def build(cls):
+        rows = (256 + cls.window - 1) // cls.window
+        per_row = (1 << cls.window) - 1
+        base = _JacobianPoint.from_affine(G)
+        points = []
+        for _ in range(rows):
+            current = base
+            for _ in range(per_row):
+                points.append(current)
+                current = current + base
+            # current is now 2^window * base, the base of the next row
+            base = current
+        # one inversion for the whole table
+        points = _JacobianPoint.batch_normalize(points)
+        cls.table = [
+            points[i : i + per_row] for i in range(0, len(points), per_row)
+        ]
+
+    @classmethod
+    def get(cls):
+        if cls.table is None:
+            cls.build()
+        return cls.table
+
+    @classmethod
+    def get_odd_multiples(cls):
+        if cls.odd_multiples is None:
+            multiples = _odd_multiples(_JacobianPoint.from_affine(G), cls.naf_window)
+            # stored with Z = 1 so they are added with mixed addition
+            cls.odd_multiples = _JacobianPoint.batch_normalize(multiples)
+        return cls.odd_multiples
+
+    @classmethod
+    def get_endomorphism_multiples(cls):
+        if cls.endomorphism_multiples is None:
+            multiples = _endomorphism_multiples(cls.get_odd_multiples())
+            cls.endomorphism_multiples = multiples
+        return cls.endomorphism_multiples
+
+    @classmethod
+    def multiply(cls, coefficient):
+        """Returns coefficient * G as a _JacobianPoint"""
+        table = cls.get()
+        coef = coefficient % N
+        mask = (1 << cls.window) - 1
+        result = _JacobianPoint.infinity()
+        i = 0
+        while coef:
+            digit = coef & mask
+            if digit:
+                result = result.add_affine(table[i][digit - 1])
+            coef >>= cls.window
+            i += 1
+        return result
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a table written by dump(): the window size in one byte,
+        then every point as 32-byte x and 32-byte y, row by row. The file
+        must hash to the digest of the table build() makes."""
+        with open(filename, "rb") as f:
+            raw = f.read()
+        window = raw[0] if raw else None
+        if window not in GENERATOR_TABLE_DIGESTS:
+            raise ValueError("no known generator table for window {}".format(window))
+        if hashlib.sha256(raw).hexdigest() != GENERATOR_TABLE_DIGESTS[window]:
+            raise ValueError("not the generator table: {}".format(filename))
+        rows = (256 + window - 1) // window
+        per_row = (1 << window) - 1
+        table = []
+        offset = 1
+        for _ in range(rows):
+            row = []
+            for _ in range(per_row):
+                x = int.from_bytes(raw[offset : offset + 32], "big")
+                y = int.from_bytes(raw[offset + 32 : offset + 64], "big")
+                row.append(_JacobianPoint(x, y, 1))
+                offset += 64
+            table.append(row)
+        cls.window = window
+        cls.table = table
+
+    @classmethod
+    def dump(cls, filename):
+        with open(filename, "wb") as f:
+            f.write(bytes([cls.window]))
+            for row in cls.get():
+                for point in row:
+                    f.write(point.x.to_bytes(32, "big"))
+                    f.write(point.y.to_bytes(32, "big"))
+
+
+class HotKeyTables:
+    """
+    Registry of wide precomputed tables for public keys that are verified
+    often, such as federation or exchange cold-wallet keys.
+
+    verify normally builds a small width-5 NAF table for v * P on every
+    call. Once a key has been seen `admit_after` times, it gets a
+    width-`naf_window` table (with its endomorphism images), normalised to
+    Z = 1 for mixed addition, and kept for later calls. At most
+    `capacity` tables are kept and the least recently used one is evicted
+    first; capacity = 0 turns the registry off. Only the latest
+    `capacity * 16` keys have their sightings counted.
+    """
+
+    capacity = 256
+    admit_after = 4
+    naf_window = 8
+    tables = OrderedDict()
+    counts = OrderedDict()
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    @classmethod
+    def get(cls, point):
+        """Returns (multiples, endomorphism_multiples) for the point, or
+        None if it is not (yet) a hot key"""
+        if cls.capacity <= 0:
+            return None
+        key = (point.x.num, point.y.num)
+        tables = cls.tables.get(key)
+        if tables is not None:
+            cls.hits += 1
+            cls.tables.move_to_end(key)
+            return tables
+        cls.misses += 1
+        count = cls.counts.pop(key, 0) + 1
+        if count < cls.admit_after:
+            cls.counts[key] = count
+            if len(cls.counts) > cls.capacity * 16:
+                cls.counts.popitem(last=False)
+            return None
+        return cls.add(point)
+
+    @classmethod
+    def add(cls, point):
+        """Builds and keeps the tables for the point right away"""
+        key = (point.x.num, point.y.num)
+        multiples = _odd_multiples(_JacobianPoint.from_affine(point), cls.naf_window)
+        multiples = _JacobianPoint.batch_normalize(multiples)
+        tables = (multiples, _endomorphism_multiples(multiples))
+        cls.tables[key] = tables
+        while len(cls.tables) > max(cls.capacity, 0):
+            cls.tables.popitem(last=False)
+            cls.evictions += 1
+        return tables
+
+    @classmethod
+    def clear(cls):
+        cls.tables.clear()
+        cls.counts.clear()
+        cls.hits = 0
+        cls.misses = 0
+        cls.evictions = 0
+
+    @classmethod
+    def stats(cls):
+        return {
+            "hits": cls.hits,
+            "misses": cls.misses,
+            "evictions": cls.evictions,
+            "size": len(cls.tables),
+            "capacity": cls.capacity,
+        }
+
+
+class SecCache:
+    """
+    Bounded LRU cache of parsed public keys, SEC bytes -> S256Point.
+
+    Parsing a compressed key takes a modular square root, and the same
+    keys show up again and again in the inputs we verify. Set `capacity`
+    with resize(); 0 turns the cache off. `hits` and `misses` count the
+    lookups so the capacity can be tuned. The cached points are shared,
+    so callers must not modify them.
+    """
+
+    capacity = 10000
+    cache = OrderedDict()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def parse(cls, sec_bin):
+        """Same as S256Point.parse, going through the cache"""
+        key = bytes(sec_bin)
+        point = cls.cache.get(key)
+        if point is not None:
+            cls.hits += 1
+            cls.cache.move_to_end(key)
+            return point
+        cls.misses += 1
+        point = S256Point.parse(key)
+        if cls.capacity > 0:
+            cls.cache[key] = point
+            if len(cls.cache) > cls.capacity:
+                # drop the least recently used key
+                cls.cache.popitem(last=False)
+        return point
+
+    @classmethod
+    def resize(cls, capacity):
+        cls.capacity = capacity
+        while len(cls.cache) > max(capacity, 0):
+            cls.cache.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        cls.cache.clear()
+        cls.hits = 0
+        cls.misses = 0
+
+    @classmethod
+    def stats(cls):
+        return {
+            "hits": cls.hits,
+            "misses": cls.misses,
+            "size": len(cls.cache),
+            "capacity": cls.capacity,
+        }
+
+
+class SigCache:
+    """
+    Bounded cache of signature checks that passed, like Bitcoin Core's
+    sigcache.
+
+    A transaction is validated once when it enters the mempool and again
+    when it shows up in a block; with the cache the second round skips
+    the elliptic curve work. Entries are salted hashes of (z, public key,
+    signature), so nobody outside the process can predict the keys.
+    Only valid signatures are stored. The cache holds roughly
+    max_bytes / entry_bytes entries and drops the least recently used
+    one when it is full; max_bytes = 0 turns it off.
+    """
+
+    max_bytes = 32 * 1024 * 1024
+    # approximate memory of one entry: the 32-byte key plus dict overhead
+    entry_bytes = 160
+    salt = os.urandom(32)
+    cache = OrderedDict()
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    @classmethod
+    def key(cls, point, z, sig):
+        # a parsed signature can hold numbers of more than 32 bytes, so r
+        # goes in with its length. s is taken mod N, as verify does.
+        r = sig.r.to_bytes((sig.r.bit_length() + 7) // 8, "big")
+        return hashlib.sha256(
+            cls.salt
+            + z.to_bytes(32, "big")
+            + point.x.num.to_bytes(32, "big")
+            + point.y.num.to_bytes(32, "big")
+            + len(r).to_bytes(2, "big")
+            + r
+            + (sig.s % N).to_bytes(32, "big")
+        ).digest()
+
+    @classmethod
+    def contains(cls, point, z, sig):
+        key = cls.key(point, z, sig)
+        if key in cls.cache:
+            cls.hits += 1
+            cls.cache.move_to_end(key)
+            return True
+        cls.misses += 1
+        return False
+
+    @classmethod
+    def add(cls, point, z, sig):
+        """Records a signature that is known to be valid"""
+        max_entries = cls.max_bytes // cls.entry_bytes
+        if max_entries <= 0:
+            return
+        cls.cache[cls.key(point, z, sig)] = None
+        while len(cls.cache) > max_entries:
+            cls.cache.popitem(last=False)
+            cls.evictions += 1
+
+    @classmethod
+    def verify(cls, point, z, sig):
+        """Same as point.verify(z, sig), going through the cache"""
+        if cls.contains(point, z, sig):
+            return True
+        if point.verify(z, sig):
+            cls.add(point, z, sig)
+            return True
+        return False
+
+    @classmethod
+    def resize(cls, max_bytes):
+        cls.max_bytes = max_bytes
+        max_entries = max(max_bytes // cls.entry_bytes, 0)
+        while len(cls.cache) > max_entries:
+            cls.cache.popitem(last=False)
+            cls.evictions += 1
+
+    @classmethod
+    def clear(cls):
+        cls.cache.clear()
+        cls.hits = 0
+        cls.misses = 0
+        cls.evictions = 0
+
+    @classmethod
+    def stats(cls):
+        return {
+            "hits": cls.hits,
+            "misses": cls.misses,
+            "evictions": cls.evictions,
+            "size": len(cls.cache),
+            "max_bytes": cls.max_bytes,
+        }
+
+
 class Signature:
 
     def __init__(self, r, s):
@@ -296,11 +1070,71 @@ class Signature:
         return cls(r, s)
 
 
+def verify_batch(items):
+    """
+    Verifies a list of (point, z, sig) triples at once. Returns a list
+    with one boolean per item, True where the signature is valid.
+
+    All the 1/s values come from one modular inversion, and items that
+    share a public key share its precomputed multiples. An ECDSA
+    signature only carries the x coordinate of R, so the checks cannot be
+    folded into a single multi-scalar multiplication; every item still
+    gets its own joint u*G + v*P pass.
+    """
+    results = [False] * len(items)
+    # s is taken mod N, as verify does, and 0 has no inverse
+    pending = [
+        i
+        for i, (point, _, sig) in enumerate(items)
+        if point.x is not None and sig.s % N != 0
+    ]
+    s_invs = _batch_inverse([items[i][2].s % N for i in pending], N)
+    tables = {}
+    for i, s_inv in zip(pending, s_invs):
+        point, z, sig = items[i]
+        key = (point.x.num, point.y.num)
+        if key not in tables:
+            tables[key] = point._verify_tables()
+        u = z * s_inv % N
+        v = sig.r * s_inv % N
+        results[i] = point._verify_scalars(u, v, sig.r, tables[key])
+    return results
+
+
+class SchnorrSignature:
+    """BIP340 signature: the x coordinate of R and s, 64 bytes in all"""
+
+    def __init__(self, r, s):
+        self.r = r
+        self.s = s
+
+    def __repr__(self):
+        return "SchnorrSignature({:x},{:x})".format(self.r, self.s)
+
+    def serialize(self):
+        return self.r.to_bytes(32, "big") + self.s.to_bytes(32, "big")
+
+    @classmethod
+    def parse(cls, signature_bin):
+        if len(signature_bin) != 64:
+            raise SyntaxError("Bad Schnorr Signature Length")
+        r = int.from_bytes(signature_bin[:32], "big")
+        s = int.from_bytes(signature_bin[32:], "big")
+        return cls(r, s)
+
+
+def _schnorr_challenge(r_bin, xonly, msg):
+    """e = int(hash_BIP0340/challenge(bytes(R) || bytes(P) || m)) mod N"""
+    h = tagged_hash("BIP0340/challenge", r_bin + xonly + msg)
+    return int.from_bytes(h, "big") % N
+
+
 class PrivateKey:
 
     def __init__(self, secret):
         self.secret = secret
         self.point = secret * G
+        self._rfc6979 = None
 
     def hex(self):
         return "{:x}".format(self.secret).zfill(64)
@@ -311,6 +1145,32 @@ class PrivateKey:
         r = (k * G).x.num
         # remember 1/k = pow(k, N-2, N)
         k_inv = pow(k, N - 2, N)
+        return self._signature(z, r, k_inv)
+
+    def sign_schnorr(self, msg, aux_rand=None):
+        """Returns the BIP340 SchnorrSignature of msg (bytes). aux_rand is
+        32 bytes of auxiliary randomness, fresh from os.urandom if None."""
+        if aux_rand is None:
+            aux_rand = os.urandom(32)
+        xonly = self.point.xonly()
+        # the x-only key stands for the point with even y
+        if self.point.y.num % 2 == 0:
+            d = self.secret
+        else:
+            d = N - self.secret
+        t = d ^ int.from_bytes(tagged_hash("BIP0340/aux", aux_rand), "big")
+        rand = tagged_hash("BIP0340/nonce", t.to_bytes(32, "big") + xonly + msg)
+        k = int.from_bytes(rand, "big") % N
+        if k == 0:
+            raise RuntimeError("Schnorr nonce is zero")
+        r_point = GeneratorTable.multiply(k).normalize()
+        if r_point.y % 2 != 0:
+            k = N - k
+        r_bin = r_point.x.to_bytes(32, "big")
+        e = _schnorr_challenge(r_bin, xonly, msg)
+        return SchnorrSignature(r_point.x, (k + e * d) % N)
+
+    def _signature(self, z, r, k_inv):
         # s = (z+r*secret) / k
         s = (z + r * self.secret) * k_inv % N
         if s > N / 2:
@@ -319,15 +1179,28 @@ class PrivateKey:
         # Signature(r, s)
         return Signature(r, s)
 
+    def _rfc6979_state(self):
+        """Returns the HMAC state of the first RFC6979 step with everything
+        but the message already fed in. It only depends on the secret, so
+        it is built once per key and copied for every message."""
+        if self._rfc6979 is None:
+            secret_bytes = self.secret.to_bytes(32, "big")
+            state = hmac.new(b"\x00" * 32, digestmod=hashlib.sha256)
+            state.update(b"\x01" * 32 + b"\x00" + secret_bytes)
+            self._rfc6979 = state
+        return self._rfc6979
+
     def deterministic_k(self, z):
-        k = b"\x00" * 32
         v = b"\x01" * 32
         if z > N:
             z -= N
         z_bytes = z.to_bytes(32, "big")
         secret_bytes = self.secret.to_bytes(32, "big")
         s256 = hashlib.sha256
-        k = hmac.new(k, v + b"\x00" + secret_bytes + z_bytes, s256).digest()
+        # k = HMAC(0x00 * 32, v + 0x00 + secret + z)
+        state = self._rfc6979_state().copy()
+        state.update(z_bytes)
+        k = state.digest()
         v = hmac.new(k, v, s256).digest()
         k = hmac.new(k, v + b"\x01" + secret_bytes + z_bytes, s256).digest()
         v = hmac.new(k, v, s256).digest()
@@ -350,3 +1223,130 @@ class PrivateKey:
         else:
             suffix = b""
         return encode_base58_checksum(prefix + secret_bytes + suffix)
+
+
+def sign_batch(items):
+    """
+    Signs a list of (private_key, z) pairs and returns one Signature per
+    pair, the same ones PrivateKey.sign would give.
+
+    Every k*G comes from the generator table, all the R points are turned
+    affine with one field inversion and all the nonces are inverted with
+    one more (Montgomery's trick). Each key also reuses its RFC6979 HMAC
+    state across messages.
+    """
+    ks = [private_key.deterministic_k(z) for private_key, z in items]
+    points = _JacobianPoint.batch_normalize([GeneratorTable.multiply(k) for k in ks])
+    k_invs = _batch_inverse(ks, N)
+    signatures = []
+    for (private_key, z), point, k_inv in zip(items, points, k_invs):
+        # r is the x coordinate of k*G
+        signatures.append(private_key._signature(z, point.x, k_inv))
+    return signatures
+
+
+def generate_key_pool(
+    start, count, step=1, compressed=True, testnet=False, batch_size=1024
+):
+    """
+    Yields (secret, sec, address) for the secrets start, start + step,
+    start + 2*step, ... (count of them, modulo N).
+
+    Only start*G and step*G are real scalar multiplications; every other
+    public key is the previous one plus step*G, a single mixed addition.
+    The points are made affine batch_size at a time with one field
+    inversion per batch, and the results are yielded as they are ready so
+    huge pools never have to fit in memory. A secret that is 0 modulo N
+    has no public key and is skipped.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1: {}".format(batch_size))
+    point = GeneratorTable.multiply(start)
+    # Z = 1, so every step is a mixed addition
+    step_point = GeneratorTable.multiply(step).normalize()
+    secret = start % N
+    remaining = count
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        batch = []
+        for _ in range(size):
+            batch.append(point)
+            point = point + step_point
+        for public_key in S256Point._batch_normalize(batch):
+            if public_key.x is not None:
+                sec = public_key.sec(compressed)
+                address = public_key.address(compressed, testnet)
+                yield secret, sec, address
+            secret = (secret + step) % N
+        remaining -= size
+
+
+def verify_schnorr_batch(items):
+    """
+    Verifies a list of (point, msg, SchnorrSignature) triples at once.
+    Returns a list with one boolean per item, like verify_batch.
+
+    With random weights a_1 = 1, a_2, ..., a_n this checks the single
+    equation of BIP340 batch verification,
+
+        (sum a_i*s_i) * G - sum a_i*R_i - sum (a_i*e_i) * P_i = 0,
+
+    with one multi-scalar multiplication over all of the points. Only if
+    that fails are the signatures checked one by one to find the bad ones.
+    """
+    results = [False] * len(items)
+    # (coefficient, point) for every R_i and P_i
+    points = []
+    g_coefficient = 0
+    pending = []
+    for i, (point, msg, sig) in enumerate(items):
+        # the point at infinity has no x-only key
+        if point.x is None or sig.r >= P or sig.s >= N:
+            continue
+        try:
+            # R is the point with even y and x = r
+            r_point = S256Point.parse_xonly(sig.r.to_bytes(32, "big"))
+        except ValueError:
+            continue
+        xonly = point.xonly()
+        e = _schnorr_challenge(sig.r.to_bytes(32, "big"), xonly, msg)
+        # the first weight can be 1, the others are random
+        if pending:
+            a = int.from_bytes(os.urandom(32), "big") % (N - 1) + 1
+        else:
+            a = 1
+        g_coefficient += a * sig.s
+        # the x-only key stands for the point with even y
+        even_point = _JacobianPoint.from_affine(point)
+        if point.y.num % 2 != 0:
+            even_point = -even_point
+        points.append((-a % N, _JacobianPoint.from_affine(r_point)))
+        points.append((-a * e % N, even_point))
+        pending.append(i)
+    if not pending:
+        return results
+    # normalise every table at once so all the additions are mixed ones
+    tables = [_odd_multiples(point, NAF_WINDOW) for _, point in points]
+    flat = _JacobianPoint.batch_normalize([p for table in tables for p in table])
+    size = len(tables[0])
+    g_multiples = GeneratorTable.get_odd_multiples()
+    if S256Point.use_glv:
+        g_endo = GeneratorTable.get_endomorphism_multiples()
+        terms = _glv_terms(g_coefficient % N, g_multiples, g_endo)
+    else:
+        terms = [(g_coefficient % N, g_multiples)]
+    for j, (coefficient, _) in enumerate(points):
+        multiples = flat[j * size : (j + 1) * size]
+        if S256Point.use_glv:
+            endo = _endomorphism_multiples(multiples)
+            terms += _glv_terms(coefficient, multiples, endo)
+        else:
+            terms.append((coefficient, multiples))
+    if _multi_multiply(terms).is_infinity():
+        for i in pending:
+            results[i] = True
+        return results
+    for i in pending:
+        point, msg, sig = items[i]
+        results[i] = point.verify_schnorr(msg, sig)
+    return results
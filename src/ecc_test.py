@@ -1,4 +1,30 @@
-from ecc import FieldElement, Point, S256Point, Signature, PrivateKey, G, N, P
+from ecc import (
+    FieldElement,
+    Point,
+    S256Field,
+    S256Point,
+    Signature,
+    PrivateKey,
+    SchnorrSignature,
+    G,
+    N,
+    P,
+    GeneratorTable,
+    HotKeyTables,
+    SecCache,
+    SigCache,
+    LAMBDA,
+    _JacobianPoint,
+    _batch_inverse,
+    _glv_split,
+    _multi_multiply,
+    _odd_multiples,
+    _wnaf,
+    generate_key_pool,
+    sign_batch,
+    verify_batch,
+    verify_schnorr_batch,
+)
 from random import randint
 
 
@@ -170,6 +196,17 @@ class TestS256Field:
         assert point.sec(compressed=False) == bytes.fromhex(uncompressed)
         assert point.sec(compressed=True) == bytes.fromhex(compressed)
 
+    def test_parse(self):
+        point = 42424242 * G
+        assert S256Point.parse(point.sec(compressed=True)) == point
+        assert S256Point.parse(point.sec(compressed=False)) == point
+        # x = 5 gives x^3 + 7 with no square root, so no point exists
+        try:
+            S256Point.parse(b"\x02" + (5).to_bytes(32, "big"))
+            assert False
+        except ValueError:
+            pass
+
     def test_address(self):
         secret = 888**3
         mainnet_address = "148dY81A9BmdpMhvYEVznrM45kWN32vSCN"
@@ -191,6 +228,316 @@ class TestS256Field:
         assert point.address(compressed=False, testnet=True) == testnet_address
 
 
+class TestJacobianPoint:
+
+    def test_matches_affine(self):
+        for coefficient in (1, 2, 3, 1485, 2**128, randint(1, N - 1)):
+            jacobian = coefficient * _JacobianPoint.from_affine(G)
+            assert jacobian.to_affine() == Point.__rmul__(G, coefficient)
+
+    def test_add(self):
+        a = _JacobianPoint.from_affine(G).double()
+        b = 5 * _JacobianPoint.from_affine(G)
+        assert (a + b).to_affine() == 7 * G
+        assert (a + a).to_affine() == 4 * G
+
+    def test_eq(self):
+        point = _JacobianPoint.from_affine(G)
+        scaled = _JacobianPoint(point.x * 4 % P, point.y * 8 % P, 2)
+        assert scaled == point
+        assert scaled.normalize().x == G.x.num
+        assert scaled != point.double()
+
+    def test_infinity(self):
+        point = _JacobianPoint.from_affine(G)
+        minus = _JacobianPoint.from_affine(Point.__rmul__(G, N - 1))
+        assert (point + minus).is_infinity()
+        assert (N * point).to_affine() == S256Point(None, None)
+        assert _JacobianPoint.from_affine(S256Point(None, None)).is_infinity()
+
+
+class TestGeneratorTable:
+
+    def test_multiply(self):
+        for coefficient in (1, 15, 16, 2**128, N - 1, randint(1, N - 1)):
+            want = Point.__rmul__(G, coefficient)
+            assert GeneratorTable.multiply(coefficient).to_affine() == want
+        assert GeneratorTable.multiply(N).is_infinity()
+
+    def test_dump_load(self, tmp_path):
+        filename = str(tmp_path / "generator.table")
+        GeneratorTable.dump(filename)
+        table = GeneratorTable.table
+        GeneratorTable.table = None
+        try:
+            GeneratorTable.load(filename)
+            assert GeneratorTable.table == table
+            # valid points, but not the multiples of G
+            with open(filename, "rb") as f:
+                raw = bytearray(f.read())
+            raw[1:65], raw[65:129] = raw[65:129], raw[1:65]
+            with open(filename, "wb") as f:
+                f.write(raw)
+            try:
+                GeneratorTable.load(filename)
+                assert False, "expected a ValueError"
+            except ValueError:
+                pass
+        finally:
+            GeneratorTable.table = table
+
+
+class TestMultiMultiply:
+
+    def test_wnaf(self):
+        for coefficient in (1, 7, 2**255 - 1, randint(1, N - 1)):
+            digits = _wnaf(coefficient, 5)
+            assert sum(d << i for i, d in enumerate(digits)) == coefficient
+            assert all(d == 0 or (d % 2 == 1 and abs(d) < 16) for d in digits)
+
+    def test_multi_multiply(self):
+        point = 1485 * G
+        jacobian = _JacobianPoint.from_affine(point)
+        for u, v in ((0, 5), (5, 0), (randint(1, N - 1), randint(1, N - 1))):
+            total = _multi_multiply(
+                [
+                    (u, _odd_multiples(_JacobianPoint.from_affine(G), 8)),
+                    (v, _odd_multiples(jacobian, 5)),
+                ]
+            )
+            want = Point.__rmul__(G, u) + Point.__rmul__(point, v)
+            assert total.to_affine() == want
+
+    def test_negative(self):
+        multiples = _odd_multiples(_JacobianPoint.from_affine(G), 5)
+        total = _multi_multiply([(-1485, multiples), (1486, multiples)])
+        assert total.to_affine() == G
+
+
+class TestGLV:
+
+    def test_split(self):
+        for coefficient in (1, LAMBDA, N - 1, randint(1, N - 1)):
+            k1, k2 = _glv_split(coefficient)
+            assert (k1 + k2 * LAMBDA) % N == coefficient
+            assert abs(k1) < 2**129 and abs(k2) < 2**129
+
+    def test_rmul(self):
+        point = 1485 * G
+        for coefficient in (1, 2, LAMBDA, N - 1, randint(1, N - 1)):
+            want = Point.__rmul__(point, coefficient)
+            assert coefficient * point == want
+            S256Point.use_glv = False
+            try:
+                assert coefficient * point == want
+            finally:
+                S256Point.use_glv = True
+
+    def test_verify(self):
+        z = 0xEC208BAA0FC1C19F708A9CA96FDEFF3AC3F230BB4A7BA4AEDE4942AD003C0F60
+        pk = PrivateKey(randint(1, N - 1))
+        sig = pk.sign(z)
+        assert pk.point.verify(z, sig)
+        assert not pk.point.verify(z + 1, sig)
+        S256Point.use_glv = False
+        try:
+            assert pk.point.verify(z, sig)
+            assert not pk.point.verify(z + 1, sig)
+        finally:
+            S256Point.use_glv = True
+
+
+class TestBatchNormalize:
+
+    def test_batch_inverse(self):
+        elements = [S256Field(1), S256Field(randint(1, P - 1)), S256Field(P - 1)]
+        for element, inverse in zip(elements, S256Field.batch_inverse(elements)):
+            assert element * inverse == S256Field(1)
+        try:
+            S256Field.batch_inverse(elements + [S256Field(0)])
+            assert False, "expected a ZeroDivisionError"
+        except ZeroDivisionError:
+            pass
+
+    def test_batch_normalize(self):
+        base = _JacobianPoint.from_affine(G)
+        points = [base.double(), 5 * base, N * base, (2**128) * base]
+        want = [2 * G, 5 * G, S256Point(None, None), (2**128) * G]
+        assert S256Point._batch_normalize(points) == want
+        for point, normal in zip(points, _JacobianPoint.batch_normalize(points)):
+            assert normal == point
+            assert normal.is_infinity() or normal.z == 1
+
+
+class TestVerifyBatch:
+
+    def test_batch_inverse(self):
+        nums = [1, 2, randint(1, N - 1), N - 1]
+        for num, inverse in zip(nums, _batch_inverse(nums, N)):
+            assert num * inverse % N == 1
+        assert _batch_inverse([], N) == []
+
+    def test_verify_batch(self):
+        z = 0xEC208BAA0FC1C19F708A9CA96FDEFF3AC3F230BB4A7BA4AEDE4942AD003C0F60
+        pk1 = PrivateKey(5000)
+        pk2 = PrivateKey(randint(1, N - 1))
+        sig1 = pk1.sign(z)
+        sig2 = pk2.sign(z + 1)
+        items = [
+            (pk1.point, z, sig1),
+            (pk2.point, z + 1, sig2),
+            (pk1.point, z + 1, sig1),
+            (pk2.point, z, sig1),
+            (pk1.point, z, Signature(sig1.r, 0)),
+            (pk1.point, z, sig1),
+            (pk1.point, z, Signature(sig1.r, sig1.s + N)),
+            (pk1.point, z, Signature(sig1.r, N)),
+        ]
+        want = [True, True, False, False, False, True, True, False]
+        assert verify_batch(items) == want
+        assert [point.verify(z, sig) for point, z, sig in items] == want
+        assert verify_batch([]) == []
+
+
+class TestHotKeyTables:
+
+    def test_get(self):
+        capacity = HotKeyTables.capacity
+        HotKeyTables.clear()
+        try:
+            HotKeyTables.capacity = 1
+            z = 0xEC208BAA0FC1C19F708A9CA96FDEFF3AC3F230BB4A7BA4AEDE4942AD003C0F60
+            pk1 = PrivateKey(5000)
+            pk2 = PrivateKey(randint(1, N - 1))
+            sig1 = pk1.sign(z)
+            sig2 = pk2.sign(z)
+            for _ in range(HotKeyTables.admit_after - 1):
+                assert pk1.point.verify(z, sig1)
+                assert HotKeyTables.stats()["size"] == 0
+            # admitted on this call, then used from the registry
+            assert pk1.point.verify(z, sig1)
+            assert pk1.point.verify(z, sig1)
+            assert not pk1.point.verify(z + 1, sig1)
+            assert HotKeyTables.stats()["hits"] == 2
+            HotKeyTables.add(pk2.point)
+            assert pk2.point.verify(z, sig2)
+            assert not pk2.point.verify(z, sig1)
+            assert HotKeyTables.stats()["evictions"] == 1
+            assert list(HotKeyTables.tables) == [(pk2.point.x.num, pk2.point.y.num)]
+            S256Point.use_glv = False
+            try:
+                assert pk2.point.verify(z, sig2)
+            finally:
+                S256Point.use_glv = True
+        finally:
+            HotKeyTables.capacity = capacity
+            HotKeyTables.clear()
+
+
+class TestSecCache:
+
+    def test_parse(self):
+        capacity = SecCache.capacity
+        SecCache.clear()
+        try:
+            SecCache.resize(2)
+            secs = [(secret * G).sec() for secret in (1, 2, 3)]
+            assert SecCache.parse(secs[0]) == G
+            assert SecCache.parse(secs[0]) is SecCache.parse(secs[0])
+            assert SecCache.stats()["hits"] == 2
+            assert SecCache.stats()["misses"] == 1
+            SecCache.parse(secs[1])
+            SecCache.parse(secs[2])
+            # secs[0] was the least recently used key
+            assert list(SecCache.cache) == secs[1:]
+            SecCache.parse(secs[1])
+            SecCache.resize(1)
+            assert list(SecCache.cache) == secs[1:2]
+            assert SecCache.stats()["misses"] == 3
+        finally:
+            SecCache.resize(capacity)
+            SecCache.clear()
+
+
+class TestSigCache:
+
+    def test_verify(self):
+        max_bytes = SigCache.max_bytes
+        SigCache.clear()
+        try:
+            z = 0xEC208BAA0FC1C19F708A9CA96FDEFF3AC3F230BB4A7BA4AEDE4942AD003C0F60
+            pk = PrivateKey(5000)
+            sig = pk.sign(z)
+            assert SigCache.verify(pk.point, z, sig)
+            assert SigCache.verify(pk.point, z, sig)
+            assert not SigCache.verify(pk.point, z + 1, sig)
+            assert SigCache.stats()["hits"] == 1
+            assert SigCache.stats()["misses"] == 2
+            # invalid signatures are never stored
+            assert len(SigCache.cache) == 1
+            # s and s + N are the same signature to verify, 33 bytes or not
+            high_s = Signature(sig.r, sig.s + N)
+            assert SigCache.verify(pk.point, z, high_s)
+            assert SigCache.stats()["hits"] == 2
+            assert not SigCache.verify(pk.point, z, Signature(5, 2**260))
+            assert not SigCache.verify(pk.point, z, Signature(2**260, sig.s))
+            assert len(SigCache.cache) == 1
+            SigCache.resize(SigCache.entry_bytes)
+            SigCache.add(pk.point, z + 2, pk.sign(z + 2))
+            assert not SigCache.contains(pk.point, z, sig)
+            assert SigCache.stats()["evictions"] == 1
+            SigCache.resize(0)
+            SigCache.add(pk.point, z, sig)
+            assert len(SigCache.cache) == 0
+        finally:
+            SigCache.resize(max_bytes)
+            SigCache.clear()
+
+
+class TestKeyPool:
+
+    def test_generate_key_pool(self):
+        pool = generate_key_pool(1485, 7, step=3, batch_size=3)
+        entries = list(pool)
+        assert [secret for secret, _, _ in entries] == list(range(1485, 1506, 3))
+        for secret, sec, address in entries:
+            point = PrivateKey(secret).point
+            assert sec == point.sec()
+            assert address == point.address()
+        # the secret 0 has no public key
+        pool = generate_key_pool(N - 1, 3, compressed=False, testnet=True)
+        secrets = [secret for secret, _, _ in pool]
+        assert secrets == [N - 1, 1]
+        assert list(generate_key_pool(1, 0)) == []
+        for batch_size in (0, -1):
+            try:
+                list(generate_key_pool(1, 3, batch_size=batch_size))
+                assert False, "expected a ValueError"
+            except ValueError:
+                pass
+
+
+class TestRecover:
+
+    def test_recover(self):
+        z = 0xEC208BAA0FC1C19F708A9CA96FDEFF3AC3F230BB4A7BA4AEDE4942AD003C0F60
+        pk = PrivateKey(randint(1, N - 1))
+        sig = pk.sign(z)
+        points = S256Point.recover(z, sig)
+        assert pk.point in points
+        assert len(points) == 2
+        for point in points:
+            assert point.verify(z, sig)
+        assert pk.point not in S256Point.recover(z + 1, sig)
+        assert S256Point.recover(z, Signature(sig.r, 0)) == []
+        assert S256Point.recover(z, Signature(0, sig.s)) == []
+        # s is reduced mod N by verify, so by recover too
+        high_s = Signature(sig.r, sig.s + N)
+        assert pk.point.verify(z, high_s)
+        assert S256Point.recover(z, high_s) == points
+        assert S256Point.recover(z, Signature(sig.r, N)) == []
+
+
 class TestSignature:
 
     def test_der(self):
@@ -213,3 +560,73 @@ class TestPrivateKey:
         pk = PrivateKey(5000)
         sig = pk.sign(z)
         assert pk.point.verify(z, sig)
+
+    def test_sign_batch(self):
+        pk1 = PrivateKey(5000)
+        pk2 = PrivateKey(randint(1, N - 1))
+        items = [(pk1, 1), (pk2, 2), (pk1, randint(1, 2**256 - 1)), (pk1, 1)]
+        signatures = sign_batch(items)
+        for (pk, z), sig in zip(items, signatures):
+            want = pk.sign(z)
+            assert (sig.r, sig.s) == (want.r, want.s)
+            assert pk.point.verify(z, sig)
+        assert sign_batch([]) == []
+
+
+class TestSchnorr:
+
+    def test_sign(self):
+        # test vectors 0 and 1 of BIP340
+        vectors = (
+            (
+                3,
+                "0000000000000000000000000000000000000000000000000000000000000000",
+                "0000000000000000000000000000000000000000000000000000000000000000",
+                "F9308A019258C31049344F85F89D5229B531C845836F99B08601F113BCE036F9",
+                "E907831F80848D1069A5371B402410364BDF1C5F8307B0084C55F1CE2DCA821525F66A4A85EA8B71E482A74F382D2CE5EBEEE8FDB2172F477DF4900D310536C0",
+            ),
+            (
+                0xB7E151628AED2A6ABF7158809CF4F3C762E7160F38B4DA56A784D9045190CFEF,
+                "0000000000000000000000000000000000000000000000000000000000000001",
+                "243F6A8885A308D313198A2E03707344A4093822299F31D0082EFA98EC4E6C89",
+                "DFF1D77F2A671C5F36183726DB2341BE58FEAE1DA2DECED843240F7B502BA659",
+                "6896BD60EEAE296DB48A229FF71DFE071BDE413E6D43F917DC8DCF8C78DE33418906D11AC976ABCCB20B091292BFF4EA897EFCB639EA871CFA95F6DE339E4B0A",
+            ),
+        )
+        for secret, aux_rand, msg, xonly, want in vectors:
+            pk = PrivateKey(secret)
+            msg = bytes.fromhex(msg)
+            sig = pk.sign_schnorr(msg, bytes.fromhex(aux_rand))
+            assert pk.point.xonly() == bytes.fromhex(xonly)
+            assert sig.serialize() == bytes.fromhex(want)
+            point = S256Point.parse_xonly(bytes.fromhex(xonly))
+            assert point.verify_schnorr(msg, SchnorrSignature.parse(sig.serialize()))
+
+    def test_verify(self):
+        msg = b"\x42" * 32
+        for secret in (5000, randint(1, N - 1)):
+            pk = PrivateKey(secret)
+            sig = pk.sign_schnorr(msg)
+            assert pk.point.verify_schnorr(msg, sig)
+            assert not pk.point.verify_schnorr(b"\x43" * 32, sig)
+            assert not pk.point.verify_schnorr(msg, SchnorrSignature(sig.r, N))
+
+    def test_verify_schnorr_batch(self):
+        items = []
+        for i in range(1, 6):
+            pk = PrivateKey(randint(1, N - 1))
+            msg = bytes([i]) * 32
+            items.append((pk.point, msg, pk.sign_schnorr(msg)))
+        assert verify_schnorr_batch(items) == [True] * 5
+        point, msg, sig = items[2]
+        items[2] = (point, b"\x00" * 32, sig)
+        items.append((point, msg, SchnorrSignature(P, sig.s)))
+        items.append((S256Point(None, None), msg, sig))
+        want = [True, True, False, True, True, False, False]
+        assert verify_schnorr_batch(items) == want
+        S256Point.use_glv = False
+        try:
+            assert verify_schnorr_batch(items) == want
+        finally:
+            S256Point.use_glv = True
+        assert verify_schnorr_batch([]) == []
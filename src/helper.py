@@ -3,6 +3,7 @@ import hashlib
 SIGHASH_ALL = 1
 SIGHASH_NONE = 2
 SIGHASH_SINGLE = 3
+SIGHASH_ANYONECANPAY = 0x80
 
 BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
 
@@ -23,6 +24,12 @@ def sha256(s):
     return hashlib.sha256(s).digest()
 
 
+def tagged_hash(tag, msg):
+    """BIP340 tagged hash: sha256(sha256(tag) + sha256(tag) + msg)"""
+    tag_hash = hashlib.sha256(tag.encode("ascii")).digest()
+    return hashlib.sha256(tag_hash + tag_hash + msg).digest()
+
+
 def encode_base58(s):
     count = 0
     for c in s:
@@ -78,6 +85,20 @@ def read_varint(s):
         return i
 
 
+def read_varint_at(buf, offset):
+    """read_varint for a buffer (bytes or memoryview) and an offset.
+    Returns the integer and the offset just past the varint"""
+    i = buf[offset]
+    if i == 0xFD:
+        return int.from_bytes(buf[offset + 1 : offset + 3], "little"), offset + 3
+    elif i == 0xFE:
+        return int.from_bytes(buf[offset + 1 : offset + 5], "little"), offset + 5
+    elif i == 0xFF:
+        return int.from_bytes(buf[offset + 1 : offset + 9], "little"), offset + 9
+    else:
+        return i, offset + 1
+
+
 def encode_varint(i):
     """encodes an integer as a varint"""
     if i < 0xFD:
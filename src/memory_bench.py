@@ -0,0 +1,52 @@
+"""Reports how many bytes of memory a parsed transaction takes.
+
+    python memory_bench.py [cache file] [copies]
+
+Parses every transaction in the cache file (tx.cache at the top of the
+repository by default) the given number of times and keeps them all
+alive, then divides the memory traced by tracemalloc by the number of
+transactions.
+"""
+
+import json
+import os
+import sys
+import tracemalloc
+from io import BytesIO
+
+from tx import LazyTx, Tx
+
+
+def bytes_per_tx(raws, parse, copies=10):
+    """Average memory held by one parsed transaction"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    txs = [parse(raw) for _ in range(copies) for raw in raws]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(txs)
+
+
+# tx.cache at the top of the repository, wherever this is run from
+DEFAULT_CACHE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "tx.cache"
+)
+
+
+def main(filename=DEFAULT_CACHE, copies=10):
+    with open(filename, "r") as f:
+        raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+    average = sum(len(raw) for raw in raws) / len(raws)
+    print("{} transactions, {:.0f} raw bytes on average".format(len(raws), average))
+    parsers = (
+        ("Tx.parse", lambda raw: Tx.parse(BytesIO(raw))),
+        ("Tx.parse_bytes", Tx.parse_bytes),
+        ("LazyTx.parse_bytes", LazyTx.parse_bytes),
+    )
+    for name, parse in parsers:
+        size = bytes_per_tx(raws, parse, copies)
+        print("{}: {:.0f} bytes per transaction".format(name, size))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
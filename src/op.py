@@ -1,6 +1,6 @@
 import hashlib
 
-from ecc import S256Point, Signature
+from ecc import S256Point, SecCache, SigCache, Signature
 from helper import (
     hash256,
     hash160,
@@ -649,7 +649,10 @@ def op_hash256(stack):
     return True
 
 
-def op_checksig(stack, z):
+def op_checksig(stack, z, sig_checks=None):
+    # when sig_checks is a list, the signature is not verified here:
+    # (point, z, sig) is appended to it for a later verify_batch() call
+    # and the check is assumed to pass
     # check that there are at least 2 elements on the stack
     if len(stack) < 2:
         return False
@@ -660,22 +663,28 @@ def op_checksig(stack, z):
     der_signature = stack.pop()[:-1]
     # parse the serialized pubkey and signature into objects
     try:
-        point = S256Point.parse(sec_pubkey)
+        point = SecCache.parse(sec_pubkey)
         sig = Signature.parse(der_signature)
     except (ValueError, SyntaxError) as e:
         print(e)
         return False
-    # verify the signature using S256Point.verify()
+    if sig_checks is not None:
+        # signatures already in the cache need no batch check
+        if not SigCache.contains(point, z, sig):
+            sig_checks.append((point, z, sig))
+        stack.append(encode_num(1))
+        return True
+    # verify the signature using S256Point.verify() through the sigcache
     # push an encoded 1 or 0 depending on whether the signature verified
-    if point.verify(z, sig):
+    if SigCache.verify(point, z, sig):
         stack.append(encode_num(1))
     else:
         stack.append(encode_num(0))
     return True
 
 
-def op_checksigverify(stack, z):
-    return op_checksig(stack, z) and op_verify(stack)
+def op_checksigverify(stack, z, sig_checks=None):
+    return op_checksig(stack, z, sig_checks) and op_verify(stack)
 
 
 def op_checkmultisig(stack, z):
@@ -698,7 +707,7 @@ def op_checkmultisig(stack, z):
     stack.pop()
     try:
         # parse all the points
-        points = [S256Point.parse(sec) for sec in sec_pubkeys]
+        points = [SecCache.parse(sec) for sec in sec_pubkeys]
         # parse all the signatures
         sigs = [Signature.parse(der) for der in der_signatures]
         # loop through the signatures
@@ -707,13 +716,27 @@ def op_checkmultisig(stack, z):
             if len(points) == 0:
                 print("signatures no good or not in right order")
                 return False
+            # the keys this signature is valid for, recovered on first need
+            candidates = None
             # we loop until we find the point which works with this signature
             while points:
                 # get the current point from the list of points
                 point = points.pop(0)
-                # we check if this signature goes with the current point
-                if point.verify(z, sig):
+                # a signature seen before is found in the sigcache
+                if SigCache.contains(point, z, sig):
+                    break
+                # otherwise one recovery replaces a verify per candidate key
+                if candidates is None:
+                    candidates = {
+                        (p.x.num, p.y.num) for p in S256Point.recover(z, sig)
+                    }
+                if (point.x.num, point.y.num) in candidates:
+                    SigCache.add(point, z, sig)
                     break
+            else:
+                # no remaining point goes with this signature
+                print("signatures no good or not in right order")
+                return False
         # the signatures are valid, so push a 1 to the stack
         stack.append(encode_num(1))
     except (ValueError, SyntaxError):
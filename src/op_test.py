@@ -19,6 +19,21 @@ class TestOp:
         stack = [sig, sec]
         assert op_checksig(stack, z)
         assert decode_num(stack[0]) == 1
+        # deferred: the check is collected and assumed to pass
+        sig_checks = []
+        stack = [sig, sec]
+        assert op_checksig(stack, z + 1, sig_checks)
+        assert decode_num(stack[0]) == 1
+        assert len(sig_checks) == 1
+        point, z_check, _ = sig_checks[0]
+        assert z_check == z + 1
+        assert point.sec(compressed=False) == sec
+        # DER lets s take 33 bytes
+        s = (2**260).to_bytes(33, "big")
+        long_sig = b"\x30\x26\x02\x01\x05\x02\x21" + s + b"\x01"
+        stack = [long_sig, sec]
+        assert op_checksig(stack, z)
+        assert decode_num(stack[0]) == 0
 
     def test_op_checkmultisig(self):
         z = 0xE71BFA115715D6FD33796948126F40A8CDD39F187E4AFB03896795189FE1423C
@@ -37,3 +52,28 @@ class TestOp:
         stack = [b"", sig1, sig2, b"\x02", sec1, sec2, b"\x02"]
         assert op_checkmultisig(stack, z)
         assert decode_num(stack[0]) == 1
+
+    def test_op_checkmultisig_no_match(self):
+        z = 0xE71BFA115715D6FD33796948126F40A8CDD39F187E4AFB03896795189FE1423C
+        sig1 = bytes.fromhex(
+            "3045022100dc92655fe37036f47756db8102e0d7d5e28b3beb83a8fef4f5dc0559bddfb94e02205a36d4e4e6c7fcd16658c50783e00c341609977aed3ad00937bf4ee942a8993701"
+        )
+        sig2 = bytes.fromhex(
+            "3045022100da6bee3c93766232079a01639d07fa869598749729ae323eab8eef53577d611b02207bef15429dcadce2121ea07f233115c6f09034c0be68db99980b9a6c5e75402201"
+        )
+        sec1 = bytes.fromhex(
+            "022626e955ea6ea6d98850c994f9107b036b1334f18ca8830bfff1295d21cfdb70"
+        )
+        sec2 = bytes.fromhex(
+            "03b287eaf122eea69030a0e9feed096bed8045c8b98bec453e1ffac7fbdbd4bb71"
+        )
+        # 1-of-2 where the signature is for the last key tried
+        stack = [b"", sig1, b"\x01", sec1, sec2, b"\x02"]
+        assert op_checkmultisig(stack, z)
+        assert decode_num(stack[0]) == 1
+        # signatures in the wrong order
+        stack = [b"", sig2, sig1, b"\x02", sec1, sec2, b"\x02"]
+        assert not op_checkmultisig(stack, z)
+        # the signature does not match any key
+        stack = [b"", sig1, b"\x01", sec1, sec2, b"\x02"]
+        assert not op_checkmultisig(stack, z + 1)
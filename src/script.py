@@ -7,6 +7,7 @@ from helper import (
     int_to_little_endian,
     little_endian_to_int,
     read_varint,
+    read_varint_at,
     sha256,
 )
 from op import (
@@ -34,6 +35,7 @@ def p2wsh_script(h256):
 
 
 class Script:
+    __slots__ = ("cmds",)
 
     def __init__(self, cmds=None):
         if cmds is None:
@@ -100,45 +102,110 @@ class Script:
             raise SyntaxError("parsing script failed")
         return cls(cmds)
 
+    @classmethod
+    def parse_at(cls, buf, offset):
+        """Same as parse, reading from a buffer (bytes, bytearray or
+        memoryview) starting at offset. Returns the script and the offset
+        past it"""
+        length = buf[offset]
+        if length < 0xFD:
+            offset += 1
+        else:
+            length, offset = read_varint_at(buf, offset)
+        end = offset + length
+        # one copy of the whole script; the cmds are sliced from it
+        raw = bytes(buf[offset:end])
+        if len(raw) != length:
+            raise SyntaxError("parsing script failed")
+        # the standard ScriptPubKeys, without going through the loop
+        if length == 25 and raw[:3] == b"\x76\xa9\x14" and raw[23:] == b"\x88\xac":
+            return cls([0x76, 0xA9, raw[3:23], 0x88, 0xAC]), end
+        if length == 23 and raw[:2] == b"\xa9\x14" and raw[22] == 0x87:
+            return cls([0xA9, raw[2:22], 0x87]), end
+        if length == 22 and raw[:2] == b"\x00\x14":
+            return cls([0, raw[2:]]), end
+        if length == 34 and raw[:2] == b"\x00\x20":
+            return cls([0, raw[2:]]), end
+        cmds = []
+        i = 0
+        while i < length:
+            current_byte = raw[i]
+            i += 1
+            if current_byte >= 1 and current_byte <= 75:
+                cmds.append(raw[i : i + current_byte])
+                i += current_byte
+            elif current_byte == 76:
+                # op_pushdata1
+                if i + 1 > length:
+                    raise SyntaxError("parsing script failed")
+                data_length = raw[i]
+                cmds.append(raw[i + 1 : i + 1 + data_length])
+                i += 1 + data_length
+            elif current_byte == 77:
+                # op_pushdata2
+                if i + 2 > length:
+                    raise SyntaxError("parsing script failed")
+                data_length = raw[i] | raw[i + 1] << 8
+                cmds.append(raw[i + 2 : i + 2 + data_length])
+                i += 2 + data_length
+            else:
+                cmds.append(current_byte)
+        if i != length:
+            raise SyntaxError("parsing script failed")
+        return cls(cmds), end
+
     def raw_serialize(self):
-        # initialize what we'll send back
-        result = b""
+        return bytes(self.raw_serialize_into(bytearray()))
+
+    def raw_serialize_into(self, buf):
+        """Appends the raw serialization (no prepended length) to the
+        bytearray buf and returns buf"""
         # go through each cmd
         for cmd in self.cmds:
             # if the cmd is an integer, it's an opcode
             if type(cmd) == int:
-                # turn the cmd into a single byte integer using int_to_little_endian
-                result += int_to_little_endian(cmd, 1)
+                buf.append(cmd)
             else:
                 # otherwise, this is an element
                 # get the length in bytes
                 length = len(cmd)
                 # for large lengths, we have to use a pushdata opcode
-                if length < 75:
-                    # turn the length into a single byte integer
-                    result += int_to_little_endian(length, 1)
-                elif length > 75 and length < 0x100:
+                if length <= 75:
+                    # the length itself is the push opcode
+                    buf.append(length)
+                elif length < 0x100:
                     # 76 is pushdata1
-                    result += int_to_little_endian(76, 1)
-                    result += int_to_little_endian(length, 1)
-                elif length >= 0x100 and length <= 520:
+                    buf.append(76)
+                    buf.append(length)
+                elif length <= 520:
                     # 77 is pushdata2
-                    result += int_to_little_endian(77, 1)
-                    result += int_to_little_endian(length, 2)
+                    buf.append(77)
+                    buf += int_to_little_endian(length, 2)
                 else:
                     raise ValueError("too long an cmd")
-                result += cmd
-        return result
+                buf += cmd
+        return buf
 
     def serialize(self):
-        # get the raw serialization (no prepended length)
-        result = self.raw_serialize()
-        # get the length of the whole thing
-        total = len(result)
-        # encode_varint the total length of the result and prepend
-        return encode_varint(total) + result
+        return bytes(self.serialize_into(bytearray()))
 
-    def evaluate(self, z, witness):
+    def serialize_into(self, buf):
+        """Appends the length-prefixed serialization to the bytearray buf
+        and returns buf"""
+        # reserve one byte for the length, enough for scripts up to 252 bytes
+        start = len(buf)
+        buf.append(0)
+        self.raw_serialize_into(buf)
+        total = len(buf) - start - 1
+        if total < 0xFD:
+            buf[start] = total
+        else:
+            buf[start : start + 1] = encode_varint(total)
+        return buf
+
+    def evaluate(self, z, witness, sig_checks=None):
+        # if sig_checks is a list, OP_CHECKSIG(VERIFY) only collect their
+        # signatures into it (see op_checksig) and are assumed to pass
         # create a copy as we may need to add to this list if we have a
         # RedeemScript
         cmds = self.cmds[:]
@@ -159,6 +226,10 @@ class Script:
                     if not operation(stack, altstack):
                         print("bad op: {}".format(OP_CODE_NAMES[cmd]))
                         return False
+                elif cmd in (172, 173) and sig_checks is not None:
+                    if not operation(stack, z, sig_checks):
+                        print("bad op: {}".format(OP_CODE_NAMES[cmd]))
+                        return False
                 elif cmd in (172, 173, 174, 175):
                     # these are signing operations, they need a sig_hash
                     # to check against
@@ -25,3 +25,50 @@ class ScriptTest:
         script_pubkey = io.BytesIO(bytes.fromhex(want))
         script = Script.parse(script_pubkey)
         assert script.serialize().hex() == want
+
+
+class TestScript:
+
+    def test_parse_at(self):
+        raw = bytes.fromhex(
+            "6a47304402207899531a52d59a6de200179928ca900254a36b8dff8bb75f5f5d71b1cdc26125022008b422690b8461cb52c3cc30330b23d574351872b7c361e9aae3649071c1a7160121035d5c93d9ac96881f19ba1f686f15f009ded7c62efe85a872e6a19b43c15a2937"
+        )
+        buf = memoryview(b"\xff" + raw + b"\xff")
+        script, offset = Script.parse_at(buf, 1)
+        assert offset == len(raw) + 1
+        assert script.cmds == Script.parse(io.BytesIO(raw)).cmds
+        assert type(script.cmds[0]) == bytes
+        # the standard ScriptPubKeys take a shortcut, with the same result
+        for raw in (
+            "1976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac",
+            "17a91474d691da1574e6b3c192ecfb52cc8984ee7b6c5687",
+            "160014" + "11" * 20,
+            "220020" + "22" * 32,
+        ):
+            raw = bytes.fromhex(raw)
+            script, offset = Script.parse_at(raw, 0)
+            assert offset == len(raw)
+            assert script.cmds == Script.parse(io.BytesIO(raw)).cmds
+        # truncated pushes fail like they do in parse
+        for raw in (b"\x01\x4c", b"\x02\x4d\x01", b"\x02\x4c\x05", b"\x02\x05\x00"):
+            for parse in (
+                lambda raw: Script.parse(io.BytesIO(raw)),
+                lambda raw: Script.parse_at(raw, 0),
+            ):
+                try:
+                    parse(raw)
+                    assert False, "expected a SyntaxError"
+                except SyntaxError:
+                    pass
+
+    def test_serialize_into(self):
+        # 75 bytes is still a direct push, 300 bytes needs OP_PUSHDATA2 and
+        # makes the script longer than a one byte length prefix can hold
+        script = Script([b"\x01" * 75, 0x87, b"\x02" * 300])
+        buf = bytearray(b"prefix")
+        assert script.serialize_into(buf) is buf
+        raw = bytes(buf[6:])
+        assert raw[:3] == bytes.fromhex("fd7c01")
+        assert raw[3] == 75
+        assert raw == script.serialize()
+        assert Script.parse(io.BytesIO(raw)).cmds == script.cmds
@@ -1,72 +1,305 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 
+import hashlib
 import json
+import struct
 import requests
+import requests.adapters
 
+from ecc import SigCache, sign_batch, verify_batch
 from helper import (
     encode_varint,
     hash256,
     int_to_little_endian,
     little_endian_to_int,
     read_varint,
+    read_varint_at,
+    sha256,
     SIGHASH_ALL,
+    SIGHASH_ANYONECANPAY,
+    SIGHASH_NONE,
+    SIGHASH_SINGLE,
 )
 from script import Script, p2pkh_script
+from txstore import DATA_MAGIC, TxStore
 
 
 class TxFetcher:
-    cache = {}
+    """
+    Fetches transactions from a block explorer and keeps them in cache.
+
+    cache is least recently used first. It holds at most max_entries
+    transactions and, if max_bytes is set, roughly max_bytes of them, where
+    a parsed transaction is taken to use memory_factor times its serialized
+    size (see memory_bench.py). Evicted transactions spill to the store if
+    one is open, so they come back from disk rather than the network.
+    """
+
+    cache = OrderedDict()
+    max_entries = 10000
+    max_bytes = None
+    memory_factor = 5
+    # approximate size of each cached transaction, when max_bytes is set
+    sizes = {}
+    cached_bytes = 0
+    hits = 0
+    misses = 0
+    evictions = 0
+    # TxStore behind the cache, see open_store
+    store = None
+
+    # block explorer used by fetch, and the connections kept open to it
+    mainnet_url = "https://blockstream.info/api/"
+    testnet_url = "https://blockstream.info/testnet/api/"
+    session = None
+    max_workers = 8
 
     @classmethod
     def get_url(cls, testnet=False):
         if testnet:
-            return "https://blockstream.info/testnet/api/"
+            return cls.testnet_url
         else:
-            return "https://blockstream.info/api/"
+            return cls.mainnet_url
+
+    @classmethod
+    def get_session(cls):
+        """One requests.Session for every fetch, so connections are reused,
+        with a pool large enough for the threads of fetch_many"""
+        if cls.session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=cls.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            cls.session = session
+        return cls.session
 
     @classmethod
     def fetch(cls, tx_id, testnet=False, fresh=False):
-        if fresh or (tx_id not in cls.cache):
-            url = "{}/tx/{}/hex".format(cls.get_url(testnet), tx_id)
-            response = requests.get(url)
-            try:
-                raw = bytes.fromhex(response.text.strip())
-            except ValueError:
-                raise ValueError("unexpected response: {}".format(response.text))
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
-                tx.locktime = little_endian_to_int(raw[-4:])
+        return cls.fetch_many([tx_id], testnet=testnet, fresh=fresh)[0]
+
+    @classmethod
+    def fetch_many(cls, tx_ids, testnet=False, fresh=False):
+        """Fetches many transactions, returned in the same order. The ones
+        neither in cache nor in the store are downloaded concurrently by
+        up to max_workers threads."""
+        found = {}
+        for tx_id in tx_ids:
+            if tx_id in found:
+                continue
+            if not fresh and tx_id in cls.cache:
+                cls.hits += 1
+                cls.cache.move_to_end(tx_id)
+                found[tx_id] = cls.cache[tx_id]
+                continue
+            cls.misses += 1
+            raw = None
+            if not fresh and cls.store is not None:
+                raw = cls.store.get(tx_id)
+            if raw is not None:
+                # already checked when it was stored, decoded when used
+                found[tx_id] = LazyTx.parse_bytes(raw, testnet=testnet)
+                cls.put(tx_id, found[tx_id])
             else:
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
-            if tx.id() != tx_id:  # <1>
-                raise ValueError("not the same id: {} vs {}".format(tx.id(), tx_id))
-            cls.cache[tx_id] = tx
-        cls.cache[tx_id].testnet = testnet
-        return cls.cache[tx_id]
+                found[tx_id] = None
+        missing = [tx_id for tx_id, tx in found.items() if tx is None]
+        if missing:
+            # made here, not lazily by the threads, so they all share one
+            cls.get_session()
+        if len(missing) == 1:
+            downloaded = [cls._download(missing[0], testnet)]
+        elif missing:
+            workers = min(cls.max_workers, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                downloads = [
+                    executor.submit(cls._download, tx_id, testnet) for tx_id in missing
+                ]
+                downloaded = [download.result() for download in downloads]
+        else:
+            downloaded = []
+        # the cache and the store are only touched from this thread
+        for tx_id, (tx, raw) in zip(missing, downloaded):
+            if cls.store is not None:
+                cls.store.add(tx_id, raw)
+            cls.put(tx_id, tx)
+            found[tx_id] = tx
+        for tx in found.values():
+            tx.testnet = testnet
+        return [found[tx_id] for tx_id in tx_ids]
+
+    @classmethod
+    def _download(cls, tx_id, testnet=False):
+        """Gets the transaction from the block explorer and checks its id.
+        Returns the parsed transaction and its raw bytes."""
+        url = "{}/tx/{}/hex".format(cls.get_url(testnet), tx_id)
+        response = cls.get_session().get(url)
+        try:
+            raw = bytes.fromhex(response.text.strip())
+        except ValueError:
+            raise ValueError("unexpected response: {}".format(response.text))
+        tx = Tx.parse(BytesIO(raw), testnet=testnet)
+        if tx.id() != tx_id:  # <1>
+            raise ValueError("not the same id: {} vs {}".format(tx.id(), tx_id))
+        return tx, raw
+
+    @classmethod
+    def put(cls, tx_id, tx):
+        """Caches the transaction as the most recently used one, evicting
+        the least recently used ones if the cache is over its limits"""
+        cls.cache[tx_id] = tx
+        cls.cache.move_to_end(tx_id)
+        if cls.max_bytes is not None:
+            cls.cached_bytes -= cls.sizes.get(tx_id, 0)
+            cls.sizes[tx_id] = cls._size(tx)
+            cls.cached_bytes += cls.sizes[tx_id]
+        cls._evict()
+
+    @classmethod
+    def _size(cls, tx):
+        if isinstance(tx, LazyTx) and not tx.is_modified():
+            start, end, _, _ = tx._span
+            return cls.memory_factor * (end - start)
+        return cls.memory_factor * len(tx.serialize())
+
+    @classmethod
+    def _evict(cls):
+        if len(cls.sizes) > len(cls.cache):
+            # entries were deleted from cache directly
+            cls.sizes = {k: cls.sizes[k] for k in cls.cache if k in cls.sizes}
+            cls.cached_bytes = sum(cls.sizes.values())
+        while cls.cache and (
+            len(cls.cache) > cls.max_entries
+            or (cls.max_bytes is not None and cls.cached_bytes > cls.max_bytes)
+        ):
+            tx_id, tx = cls.cache.popitem(last=False)
+            cls.cached_bytes -= cls.sizes.pop(tx_id, 0)
+            cls.evictions += 1
+            # only spill what really has this id, anything can be put in cache
+            if cls.store is not None and tx_id not in cls.store:
+                if tx.id() == tx_id:
+                    cls.store.add(tx_id, tx.serialize())
+
+    @classmethod
+    def resize(cls, max_entries=None, max_bytes=None):
+        """Sets new limits, max_bytes=None meaning no limit in bytes"""
+        if max_entries is not None:
+            cls.max_entries = max_entries
+        cls.max_bytes = max_bytes
+        if max_bytes is None:
+            cls.sizes = {}
+            cls.cached_bytes = 0
+        else:
+            cls.sizes = {k: cls._size(tx) for k, tx in cls.cache.items()}
+            cls.cached_bytes = sum(cls.sizes.values())
+        cls._evict()
+
+    @classmethod
+    def clear(cls):
+        cls.cache.clear()
+        cls.sizes = {}
+        cls.cached_bytes = 0
+        cls.hits = 0
+        cls.misses = 0
+        cls.evictions = 0
+
+    @classmethod
+    def stats(cls):
+        return {
+            "hits": cls.hits,
+            "misses": cls.misses,
+            "evictions": cls.evictions,
+            "size": len(cls.cache),
+            "bytes": cls.cached_bytes,
+            "max_entries": cls.max_entries,
+            "max_bytes": cls.max_bytes,
+        }
+
+    @classmethod
+    def open_store(cls, filename):
+        """Keeps every fetched transaction in the TxStore in filename and
+        looks there before going to the network. Opening it takes the same
+        time however many transactions it holds."""
+        if cls.store is not None:
+            cls.store.close()
+        cls.store = TxStore(filename)
+        return cls.store
 
     @classmethod
     def load_cache(cls, filename):
+        with open(filename, "rb") as f:
+            if f.read(len(DATA_MAGIC)) == DATA_MAGIC:
+                cls.open_store(filename)
+                return
         disk_cache = json.loads(open(filename, "r").read())
         for k, raw_hex in disk_cache.items():
             raw = bytes.fromhex(raw_hex)
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw))
-                tx.locktime = little_endian_to_int(raw[-4:])
-            else:
-                tx = Tx.parse(BytesIO(raw))
-            cls.cache[k] = tx
+            cls.put(k, Tx.parse(BytesIO(raw)))
 
     @classmethod
     def dump_cache(cls, filename):
+        if cls.store is not None and filename == cls.store.filename:
+            # only what is missing gets appended
+            for k, tx in cls.cache.items():
+                if k not in cls.store:
+                    cls.store.add(k, tx.serialize())
+            return
         with open(filename, "w") as f:
             to_dump = {k: tx.serialize().hex() for k, tx in cls.cache.items()}
             s = json.dumps(to_dump, sort_keys=True, indent=4)
             f.write(s)
 
 
+# unpackers for Tx.parse_at, reading straight from the buffer
+_UINT32 = struct.Struct("<I").unpack_from
+_UINT64 = struct.Struct("<Q").unpack_from
+_OUTPOINT = struct.Struct("<32sI").unpack_from
+
+
+def _parse_witness_at(buf, offset):
+    """Parses the witness items of one input at offset in buf.
+    Returns the items and the offset past them"""
+    num_items, offset = read_varint_at(buf, offset)
+    items = []
+    for _ in range(num_items):
+        item_len, offset = read_varint_at(buf, offset)
+        if item_len == 0:
+            items.append(0)
+        else:
+            items.append(bytes(buf[offset : offset + item_len]))
+            offset += item_len
+    return items, offset
+
+
+def _skip_varint_data(buf, offset):
+    """Returns the offset past a varint length and the data it counts"""
+    length, offset = read_varint_at(buf, offset)
+    return offset + length
+
+
+def _evaluate_script(check):
+    """Evaluates one (combined script, z, witness) from Tx.script_check,
+    at module level so it can run in a worker process"""
+    combined, z, witness = check
+    return combined.evaluate(z, witness)
+
+
 class Tx:
+    # no per-instance __dict__: there can be millions of these in a cache
+    __slots__ = (
+        "version",
+        "tx_ins",
+        "tx_outs",
+        "locktime",
+        "testnet",
+        "segwit",
+        "_hash_prevouts",
+        "_hash_sequence",
+        "_hash_outputs",
+        "_bip143_key",
+        "_legacy_sighash",
+        "_ids",
+    )
 
     def __init__(self, version, tx_ins, tx_outs, locktime, testnet=False, segwit=False):
         self.version = version
@@ -78,6 +311,9 @@ class Tx:
         self._hash_prevouts = None
         self._hash_sequence = None
         self._hash_outputs = None
+        self._bip143_key = None
+        self._legacy_sighash = None
+        self._ids = None
 
     def __repr__(self):
         tx_ins = ""
@@ -100,7 +336,63 @@ class Tx:
 
     def hash(self):
         """Binary hash of the legacy serialization"""
-        return hash256(self.serialize())[::-1]
+        return self._hashes()[0]
+
+    def wtxid(self):
+        """Human-readable hexadecimal of the witness transaction hash"""
+        return self.witness_hash().hex()
+
+    def witness_hash(self):
+        """Binary hash of the full serialization, witness included.
+        Same as hash() for a transaction without witness data."""
+        return self._hashes()[1]
+
+    def invalidate(self):
+        """Drops the cached txid, wtxid and sighash pieces. Assigning version, locktime,
+        segwit, tx_ins or tx_outs is noticed without it (see _stamp); call
+        it after changing the inputs, outputs or scripts in place."""
+        self._ids = None
+        self._legacy_sighash = None
+        self._bip143_key = None
+
+    def _stamp(self):
+        """The attributes of the transaction itself, checked in constant
+        time whenever a cached value is used. The lists are compared by
+        identity first, so nothing is copied."""
+        return (self.version, self.locktime, self.segwit, self.tx_ins, self.tx_outs)
+
+    def _hashes(self):
+        """(txid, wtxid) hashes from one serialization of the inputs and
+        outputs. They are kept until the transaction changes (see
+        invalidate)."""
+        stamp = self._stamp()
+        if self._ids is not None and self._ids[0] == stamp:
+            return self._ids[1]
+        raw = bytearray(int_to_little_endian(self.version, 4))
+        if self.segwit:
+            raw += b"\x00\x01"
+        body_start = len(raw)
+        self._serialize_body_into(raw)
+        body_end = len(raw)
+        if self.segwit:
+            self._serialize_witness_into(raw)
+        raw += int_to_little_endian(self.locktime, 4)
+        view = memoryview(raw)
+        self._ids = (stamp, self._raw_hashes(view, view[body_start:body_end]))
+        return self._ids[1]
+
+    def _raw_hashes(self, raw, body):
+        """(txid, wtxid) hashes of a raw serialization, given the span of
+        its inputs and outputs"""
+        if self.segwit:
+            h = hashlib.sha256(raw[:4])
+            h.update(body)
+            h.update(raw[-4:])
+            tx_hash = hashlib.sha256(h.digest()).digest()[::-1]
+            witness_hash = hash256(raw)[::-1]
+        else:
+            tx_hash = witness_hash = hash256(raw)[::-1]
+        return tx_hash, witness_hash
 
     @classmethod
     def parse(cls, s, testnet=False):
@@ -153,44 +445,115 @@ class Tx:
         locktime = little_endian_to_int(s.read(4))
         return cls(version, inputs, outputs, locktime, testnet=testnet, segwit=True)
 
+    @classmethod
+    def parse_bytes(cls, buf, testnet=False):
+        """Parses a transaction from a buffer (bytes, bytearray or
+        memoryview) without going through a stream"""
+        return cls.parse_at(buf, 0, testnet=testnet)[0]
+
+    @classmethod
+    def parse_at(cls, buf, offset, testnet=False):
+        """Parses the transaction starting at offset in buf and returns it
+        with the offset just past it, so transactions stored back to back
+        can be walked. Fields are unpacked from buf in place; each script
+        is copied once and its cmds sliced from that copy."""
+        version = _UINT32(buf, offset)[0]
+        offset += 4
+        segwit = buf[offset] == 0
+        if segwit:
+            if buf[offset + 1] != 1:  # <1>
+                marker = bytes(buf[offset : offset + 2])
+                raise RuntimeError("Not a segwit transaction {}".format(marker))
+            offset += 2
+        # TxIn.parse_at and TxOut.parse_at inlined, this is the hot loop
+        parse_script = Script.parse_at
+        num_inputs, offset = read_varint_at(buf, offset)
+        inputs = []
+        for _ in range(num_inputs):
+            prev_tx, prev_index = _OUTPOINT(buf, offset)
+            script_sig, offset = parse_script(buf, offset + 36)
+            sequence = _UINT32(buf, offset)[0]
+            offset += 4
+            inputs.append(TxIn(prev_tx[::-1], prev_index, script_sig, sequence))
+        num_outputs, offset = read_varint_at(buf, offset)
+        outputs = []
+        for _ in range(num_outputs):
+            amount = _UINT64(buf, offset)[0]
+            script_pubkey, offset = parse_script(buf, offset + 8)
+            outputs.append(TxOut(amount, script_pubkey))
+        if segwit:
+            for tx_in in inputs:
+                tx_in.witness, offset = _parse_witness_at(buf, offset)
+        locktime = _UINT32(buf, offset)[0]
+        offset += 4
+        tx = cls(version, inputs, outputs, locktime, testnet=testnet, segwit=segwit)
+        return tx, offset
+
     def serialize(self):
+        return bytes(self.serialize_into(bytearray()))
+
+    def serialize_into(self, buf):
+        """Appends the serialization to the bytearray buf and returns buf,
+        so many transactions can be written into one buffer"""
         if self.segwit:
-            return self.serialize_segwit()
+            return self.serialize_segwit_into(buf)
         else:
-            return self.serialize_legacy()
+            return self.serialize_legacy_into(buf)
 
-    def serialize_legacy(self):  # <1>
-        result = int_to_little_endian(self.version, 4)
-        result += encode_varint(len(self.tx_ins))
-        for tx_in in self.tx_ins:
-            result += tx_in.serialize()
-        result += encode_varint(len(self.tx_outs))
-        for tx_out in self.tx_outs:
-            result += tx_out.serialize()
-        result += int_to_little_endian(self.locktime, 4)
-        return result
+    def serialize_legacy(self):
+        return bytes(self.serialize_legacy_into(bytearray()))
+
+    def serialize_legacy_into(self, buf):  # <1>
+        buf += int_to_little_endian(self.version, 4)
+        self._serialize_body_into(buf)
+        buf += int_to_little_endian(self.locktime, 4)
+        return buf
 
     def serialize_segwit(self):
-        result = int_to_little_endian(self.version, 4)
-        result += b"\x00\x01"  # <2>
-        result += encode_varint(len(self.tx_ins))
+        return bytes(self.serialize_segwit_into(bytearray()))
+
+    def serialize_segwit_into(self, buf):
+        buf += int_to_little_endian(self.version, 4)
+        buf += b"\x00\x01"  # <2>
+        self._serialize_body_into(buf)
+        self._serialize_witness_into(buf)  # <3>
+        buf += int_to_little_endian(self.locktime, 4)
+        return buf
+
+    def _serialize_body_into(self, buf):
+        """The inputs and outputs, common to both serializations"""
+        buf += encode_varint(len(self.tx_ins))
         for tx_in in self.tx_ins:
-            result += tx_in.serialize()
-        result += encode_varint(len(self.tx_outs))
+            tx_in.serialize_into(buf)
+        buf += encode_varint(len(self.tx_outs))
         for tx_out in self.tx_outs:
-            result += tx_out.serialize()
-        for tx_in in self.tx_ins:  # <3>
-            result += int_to_little_endian(len(tx_in.witness), 1)
-            for item in tx_in.witness:
+            tx_out.serialize_into(buf)
+
+    def _serialize_witness_into(self, buf):
+        for tx_in in self.tx_ins:
+            witness = tx_in.witness or []
+            buf += int_to_little_endian(len(witness), 1)
+            for item in witness:
                 if type(item) == int:
-                    result += int_to_little_endian(item, 1)
+                    buf += int_to_little_endian(item, 1)
                 else:
-                    result += encode_varint(len(item)) + item
-        result += int_to_little_endian(self.locktime, 4)
-        return result
+                    buf += encode_varint(len(item))
+                    buf += item
+
+    def prefetch_prevouts(self, input_indexes=None):
+        """Fetches the transactions of the given inputs (all by default) in
+        one concurrent round (see TxFetcher.fetch_many), so value() and
+        script_pubkey() find them in cache"""
+        if self.is_coinbase():
+            return
+        if input_indexes is None:
+            input_indexes = range(len(self.tx_ins))
+        tx_ids = [self.tx_ins[i].prev_tx.hex() for i in input_indexes]
+        TxFetcher.fetch_many(tx_ids, testnet=self.testnet)
 
     def fee(self):
         """Returns the fee of this transaction in satoshi"""
+        self.prefetch_prevouts()
         input_sum, output_sum = 0, 0
         for tx_in in self.tx_ins:
             input_sum += tx_in.value(self.testnet)
@@ -198,48 +561,134 @@ class Tx:
             output_sum += tx_out.amount
         return input_sum - output_sum
 
-    def sig_hash(self, input_index, redeem_script=None):
+    def _legacy_sighash_parts(self):
+        """Serializes the pieces of the legacy sighash preimage that are
+        shared by every input, once per transaction. They are rebuilt if
+        the transaction was changed since the last call (see invalidate)."""
+        stamp = self._stamp()
+        if self._legacy_sighash is None or self._legacy_sighash[0] != stamp:
+            outpoints = [
+                tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
+                for tx_in in self.tx_ins
+            ]
+            outputs = [tx_out.serialize() for tx_out in self.tx_outs]
+            parts = {
+                "outpoints": outpoints,
+                # every input with an empty ScriptSig, 41 bytes each
+                "blank_inputs": b"".join(
+                    outpoint + b"\x00" + int_to_little_endian(tx_in.sequence, 4)
+                    for outpoint, tx_in in zip(outpoints, self.tx_ins)
+                ),
+                # the same with sequence 0, for SIGHASH_NONE and SIGHASH_SINGLE
+                "blank_inputs_no_sequence": b"".join(
+                    outpoint + b"\x00" * 5 for outpoint in outpoints
+                ),
+                "outputs": outputs,
+                "all_outputs": encode_varint(len(outputs)) + b"".join(outputs),
+            }
+            self._legacy_sighash = (stamp, parts)
+        return self._legacy_sighash[1]
+
+    def sig_hash(self, input_index, redeem_script=None, hash_type=SIGHASH_ALL):
         """Returns the integer representation of the hash that needs to get
-        signed for index input_index"""
+        signed for index input_index, for any SIGHASH_ALL/NONE/SINGLE type,
+        optionally with SIGHASH_ANYONECANPAY.
+
+        The parts shared by all the inputs are serialized once per
+        transaction (see _legacy_sighash_parts) and fed to sha256 as slices,
+        so nothing is reserialized for each input."""
+        parts = self._legacy_sighash_parts()
+        tx_in = self.tx_ins[input_index]
+        base_type = hash_type & 0x1F
+        if base_type == SIGHASH_SINGLE and input_index >= len(self.tx_outs):
+            # consensus quirk: with no matching output the hash is the
+            # uint256 1, bytes 01 00..00, read big endian like the others
+            return int.from_bytes(b"\x01" + b"\x00" * 31, "big")
+        # if the RedeemScript was passed in, that's the ScriptSig
+        if redeem_script:
+            script_sig = redeem_script
+        # otherwise the previous tx's ScriptPubkey is the ScriptSig
+        else:
+            script_sig = tx_in.script_pubkey(self.testnet)
+        signing_input = (
+            parts["outpoints"][input_index]
+            + script_sig.serialize()
+            + int_to_little_endian(tx_in.sequence, 4)
+        )
         # start the serialization with version
-        # use int_to_little_endian in 4 bytes
-        s = int_to_little_endian(self.version, 4)
-        # add how many inputs there are using encode_varint
-        s += encode_varint(len(self.tx_ins))
-        # loop through each input using enumerate, so we have the input index
-        for i, tx_in in enumerate(self.tx_ins):
-            # if the input index is the one we're signing
-            if i == input_index:
-                # if the RedeemScript was passed in, that's the ScriptSig
-                if redeem_script:
-                    script_sig = redeem_script
-                # otherwise the previous tx's ScriptPubkey is the ScriptSig
-                else:
-                    script_sig = tx_in.script_pubkey(self.testnet)
-            # Otherwise, the ScriptSig is empty
+        h = hashlib.sha256(int_to_little_endian(self.version, 4))
+        if hash_type & SIGHASH_ANYONECANPAY:
+            # only the input being signed is committed to
+            h.update(b"\x01")
+            h.update(signing_input)
+        else:
+            # the other inputs have an empty ScriptSig
+            if base_type in (SIGHASH_NONE, SIGHASH_SINGLE):
+                blank_inputs = memoryview(parts["blank_inputs_no_sequence"])
             else:
-                script_sig = None
-            # add the serialization of the input with the ScriptSig we want
-            s += TxIn(
-                prev_tx=tx_in.prev_tx,
-                prev_index=tx_in.prev_index,
-                script_sig=script_sig,
-                sequence=tx_in.sequence,
-            ).serialize()
-        # add how many outputs there are using encode_varint
-        s += encode_varint(len(self.tx_outs))
-        # add the serialization of each output
-        for tx_out in self.tx_outs:
-            s += tx_out.serialize()
-        # add the locktime using int_to_little_endian in 4 bytes
-        s += int_to_little_endian(self.locktime, 4)
-        # add SIGHASH_ALL using int_to_little_endian in 4 bytes
-        s += int_to_little_endian(SIGHASH_ALL, 4)
+                blank_inputs = memoryview(parts["blank_inputs"])
+            h.update(encode_varint(len(self.tx_ins)))
+            h.update(blank_inputs[: 41 * input_index])
+            h.update(signing_input)
+            h.update(blank_inputs[41 * (input_index + 1) :])
+        if base_type == SIGHASH_NONE:
+            h.update(b"\x00")
+        elif base_type == SIGHASH_SINGLE:
+            # the earlier outputs are blank: amount -1 and an empty script
+            h.update(encode_varint(input_index + 1))
+            h.update((b"\xff" * 8 + b"\x00") * input_index)
+            h.update(parts["outputs"][input_index])
+        else:
+            h.update(parts["all_outputs"])
+        # add the locktime and the hash type in 4 bytes each
+        h.update(int_to_little_endian(self.locktime, 4))
+        h.update(int_to_little_endian(hash_type, 4))
         # hash256 the serialization
-        h256 = hash256(s)
+        h256 = sha256(h.digest())
         # convert the result to an integer using int.from_bytes(x, 'big')
         return int.from_bytes(h256, "big")
-    
+
+    def _check_bip143_cache(self):
+        """Drops the BIP143 midstates if the transaction was changed since
+        they were computed (see invalidate)"""
+        stamp = self._stamp()
+        if self._bip143_key != stamp:
+            self._hash_prevouts = None
+            self._hash_sequence = None
+            self._hash_outputs = None
+            self._bip143_key = stamp
+
+    def hash_prevouts(self):
+        """hash256 of every outpoint, computed once per transaction
+        together with hash_sequence"""
+        self._check_bip143_cache()
+        if self._hash_prevouts is None:
+            all_prevouts = b"".join(
+                tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
+                for tx_in in self.tx_ins
+            )
+            all_sequence = b"".join(
+                int_to_little_endian(tx_in.sequence, 4) for tx_in in self.tx_ins
+            )
+            self._hash_prevouts = hash256(all_prevouts)
+            self._hash_sequence = hash256(all_sequence)
+        return self._hash_prevouts
+
+    def hash_sequence(self):
+        """hash256 of every input sequence, computed once per transaction"""
+        self._check_bip143_cache()
+        if self._hash_sequence is None:
+            self.hash_prevouts()  # this also calculates self._hash_sequence
+        return self._hash_sequence
+
+    def hash_outputs(self):
+        """hash256 of every serialized output, computed once per transaction"""
+        self._check_bip143_cache()
+        if self._hash_outputs is None:
+            all_outputs = b"".join(tx_out.serialize() for tx_out in self.tx_outs)
+            self._hash_outputs = hash256(all_outputs)
+        return self._hash_outputs
+
     def sig_hash_bip143(self, input_index, redeem_script=None, witness_script=None):
         '''Returns the integer representation of the hash that needs to get
         signed for index input_index'''
@@ -255,15 +704,24 @@ class Tx:
         else:
             script_code = p2pkh_script(tx_in.script_pubkey(self.testnet).cmds[1]).serialize()
         s += script_code
-        s += int_to_little_endian(tx_in.value(), 8)
+        s += int_to_little_endian(tx_in.value(self.testnet), 8)
         s += int_to_little_endian(tx_in.sequence, 4)
         s += self.hash_outputs()
         s += int_to_little_endian(self.locktime, 4)
         s += int_to_little_endian(SIGHASH_ALL, 4)
         return int.from_bytes(hash256(s), 'big')
 
-    def verify_input(self, input_index):
-        """Returns whether the input has a valid signature"""
+    def verify_input(self, input_index, sig_checks=None):
+        """Returns whether the input has a valid signature.
+        If sig_checks is a list, the OP_CHECKSIG signatures are collected
+        into it instead of being verified (see Script.evaluate)."""
+        combined, z, witness = self.script_check(input_index)
+        # evaluate the combined script
+        return combined.evaluate(z, witness, sig_checks)
+
+    def script_check(self, input_index):
+        """Resolves the previous output of the input and returns the
+        (combined script, z, witness) that verify_input evaluates"""
         # get the relevant input
         tx_in = self.tx_ins[input_index]
         # grab the previous ScriptPubKey
@@ -304,36 +762,82 @@ class Tx:
                 witness = None
         # combine the current ScriptSig and the previous ScriptPubKey
         combined = tx_in.script_sig + script_pubkey
-        # evaluate the combined script
-        return combined.evaluate(z, witness)
+        return combined, z, witness
+
+    def first_invalid_input(self, workers=None):
+        """Returns the index of the first input whose script fails, or
+        None if all of them pass.
+        With workers set, every prevout and sighash is resolved here first
+        and the scripts are then evaluated in a pool of that many
+        processes. The answer is the same as the serial one."""
+        if not workers:
+            for i in range(len(self.tx_ins)):
+                if not self.verify_input(i):
+                    return i
+            return None
+        checks = [self.script_check(i) for i in range(len(self.tx_ins))]
+        chunksize = max(1, len(checks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map keeps the input order, whichever worker finishes first
+            results = executor.map(_evaluate_script, checks, chunksize=chunksize)
+            for i, valid in enumerate(results):
+                if not valid:
+                    return i
+        return None
 
-    def verify(self):
-        """Verify this transaction"""
+    def verify(self, batch=False, workers=None):
+        """Verify this transaction.
+        With batch=True the OP_CHECKSIG signatures of all the inputs are
+        checked together with verify_batch(). With workers set the inputs
+        are checked in parallel processes (see first_invalid_input)."""
         # check that we're not creating money
         if self.fee() < 0:
             return False
+        if workers:
+            return self.first_invalid_input(workers) is None
+        if batch:
+            # evaluate every script assuming its signatures are good
+            sig_checks = []
+            for i in range(len(self.tx_ins)):
+                if not self.verify_input(i, sig_checks):
+                    break
+            else:
+                results = verify_batch(sig_checks)
+                for (point, z, sig), valid in zip(sig_checks, results):
+                    if valid:
+                        SigCache.add(point, z, sig)
+                if all(results):
+                    return True
+            # a script or a signature failed: a script may still accept a
+            # bad signature, so fall back to the exact serial evaluation
         # check that each input has a valid ScriptSig
-        for i in range(len(self.tx_ins)):
-            if not self.verify_input(i):
-                return False
-        return True
+        return self.first_invalid_input() is None
 
     def sign_input(self, input_index, private_key):
         """Signs the input using the private key"""
-        # get the signature hash (z)
-        z = self.sig_hash(input_index)
-        # get der signature of z from private key
-        der = private_key.sign(z).der()
-        # append the SIGHASH_ALL to der (use SIGHASH_ALL.to_bytes(1, 'big'))
-        sig = der + SIGHASH_ALL.to_bytes(1, "big")
-        # calculate the sec
-        sec = private_key.point.sec()
-        # initialize a new script with [sig, sec] as the cmds
-        script_sig = Script([sig, sec])
-        # change input's script_sig to new script
-        self.tx_ins[input_index].script_sig = script_sig
-        # return whether sig is valid using self.verify_input
-        return self.verify_input(input_index)
+        return self.sign_inputs([(input_index, private_key)])
+
+    def sign_inputs(self, items):
+        """Signs many inputs at once from (input_index, private_key) pairs,
+        with the bulk signing of sign_batch()"""
+        self.prefetch_prevouts([input_index for input_index, _ in items])
+        # get the signature hash (z) of every input
+        zs = [self.sig_hash(input_index) for input_index, _ in items]
+        signatures = sign_batch(
+            [(private_key, z) for (_, private_key), z in zip(items, zs)]
+        )
+        for (input_index, private_key), signature in zip(items, signatures):
+            # append the SIGHASH_ALL to der (use SIGHASH_ALL.to_bytes(1, 'big'))
+            sig = signature.der() + SIGHASH_ALL.to_bytes(1, "big")
+            # calculate the sec
+            sec = private_key.point.sec()
+            # initialize a new script with [sig, sec] as the cmds
+            script_sig = Script([sig, sec])
+            # change input's script_sig to new script
+            self.tx_ins[input_index].script_sig = script_sig
+        self.invalidate()
+        # return whether the sigs are valid using self.verify_input
+        return all(self.verify_input(input_index) for input_index, _ in items)
 
     def is_coinbase(self):
         """Returns whether this transaction is a coinbase transaction or not"""
@@ -351,8 +855,203 @@ class Tx:
         return True
 
 
+class LazyTx(Tx):
+    """A Tx over its raw bytes that only decodes the inputs and outputs
+    which are accessed. tx_ins and tx_outs are read-only sequences of the
+    decoded objects; the objects themselves can be changed as usual.
+    Until something changes, id() and serialize() use the raw bytes."""
+
+    __slots__ = ("_buf", "_span", "_witness_offsets", "_parsed", "_raw_ids")
+
+    def __init__(
+        self,
+        buf,
+        span,
+        in_offsets,
+        out_offsets,
+        witness_offsets,
+        version,
+        locktime,
+        testnet=False,
+        segwit=False,
+    ):
+        super().__init__(
+            version,
+            _LazySequence(self._decode_tx_in, in_offsets),
+            _LazySequence(self._decode_tx_out, out_offsets),
+            locktime,
+            testnet=testnet,
+            segwit=segwit,
+        )
+        self._buf = buf
+        # the whole transaction and its inputs and outputs, as (start, end)
+        self._span = span
+        self._witness_offsets = witness_offsets
+        self._parsed = (version, locktime, segwit, self.tx_ins, self.tx_outs)
+        self._raw_ids = None
+
+    @classmethod
+    def parse_bytes(cls, buf, testnet=False):
+        return cls.parse_at(buf, 0, testnet=testnet)[0]
+
+    @classmethod
+    def parse_at(cls, buf, offset, testnet=False):
+        """Indexes the transaction starting at offset in buf, reading only
+        the lengths needed to find each input, output and witness. Returns
+        it with the offset just past it. buf must not be modified."""
+        start = offset
+        version = _UINT32(buf, offset)[0]
+        offset += 4
+        segwit = buf[offset] == 0
+        if segwit:
+            if buf[offset + 1] != 1:
+                marker = bytes(buf[offset : offset + 2])
+                raise RuntimeError("Not a segwit transaction {}".format(marker))
+            offset += 2
+        body_start = offset
+        num_inputs, offset = read_varint_at(buf, offset)
+        in_offsets = []
+        for _ in range(num_inputs):
+            in_offsets.append(offset)
+            # outpoint, ScriptSig, sequence
+            offset = _skip_varint_data(buf, offset + 36) + 4
+        num_outputs, offset = read_varint_at(buf, offset)
+        out_offsets = []
+        for _ in range(num_outputs):
+            out_offsets.append(offset)
+            # amount, ScriptPubKey
+            offset = _skip_varint_data(buf, offset + 8)
+        body_end = offset
+        witness_offsets = []
+        if segwit:
+            for _ in range(num_inputs):
+                witness_offsets.append(offset)
+                num_items, offset = read_varint_at(buf, offset)
+                for _ in range(num_items):
+                    offset = _skip_varint_data(buf, offset)
+        locktime = _UINT32(buf, offset)[0]
+        offset += 4
+        tx = cls(
+            buf,
+            (start, offset, body_start, body_end),
+            in_offsets,
+            out_offsets,
+            witness_offsets,
+            version,
+            locktime,
+            testnet=testnet,
+            segwit=segwit,
+        )
+        return tx, offset
+
+    def _decode_tx_in(self, index, offset):
+        tx_in = TxIn.parse_at(self._buf, offset)[0]
+        if self._parsed[2]:
+            witness_offset = self._witness_offsets[index]
+            tx_in.witness = _parse_witness_at(self._buf, witness_offset)[0]
+        return tx_in, self._tx_in_key(tx_in)
+
+    def _decode_tx_out(self, index, offset):
+        tx_out = TxOut.parse_at(self._buf, offset)[0]
+        return tx_out, self._tx_out_key(tx_out)
+
+    def _tx_in_key(self, tx_in):
+        witness = tuple(tx_in.witness or ()) if self._parsed[2] else None
+        return (
+            tx_in.prev_tx,
+            tx_in.prev_index,
+            tuple(tx_in.script_sig.cmds),
+            tx_in.sequence,
+            witness,
+        )
+
+    def _tx_out_key(self, tx_out):
+        return (tx_out.amount, tuple(tx_out.script_pubkey.cmds))
+
+    def is_modified(self):
+        """Whether anything changed since parsing. Only the decoded inputs
+        and outputs are compared; the others cannot have been touched."""
+        version, locktime, segwit, tx_ins, tx_outs = self._parsed
+        if (self.version, self.locktime, self.segwit) != (version, locktime, segwit):
+            return True
+        if self.tx_ins is not tx_ins or self.tx_outs is not tx_outs:
+            return True
+        for tx_in, key in tx_ins.decoded():
+            if self._tx_in_key(tx_in) != key:
+                return True
+        for tx_out, key in tx_outs.decoded():
+            if self._tx_out_key(tx_out) != key:
+                return True
+        return False
+
+    def _hashes(self):
+        if self.is_modified():
+            return super()._hashes()
+        if self._raw_ids is None:
+            self._raw_ids = self._raw_hashes(self._raw_bytes(), self._raw_body())
+        return self._raw_ids
+
+    def serialize(self):
+        """The original bytes, unless the transaction was changed"""
+        if self.is_modified():
+            return super().serialize()
+        return bytes(self._raw_bytes())
+
+    def serialize_into(self, buf):
+        if self.is_modified():
+            return super().serialize_into(buf)
+        buf += self._raw_bytes()
+        return buf
+
+    def _raw_bytes(self):
+        start, end, _, _ = self._span
+        return memoryview(self._buf)[start:end]
+
+    def _raw_body(self):
+        _, _, start, end = self._span
+        return memoryview(self._buf)[start:end]
+
+
+class _LazySequence:
+    """Read-only sequence that decodes item i from offsets[i] on first
+    access, with decode(i, offset) returning (item, key at decode time)"""
+
+    __slots__ = ("_decode", "_offsets", "_items")
+
+    def __init__(self, decode, offsets):
+        self._decode = decode
+        self._offsets = offsets
+        self._items = [None] * len(offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("index out of range")
+        if self._items[index] is None:
+            self._items[index] = self._decode(index, self._offsets[index])
+        return self._items[index][0]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def decoded(self):
+        """(item, key) of every item decoded so far"""
+        return [item for item in self._items if item is not None]
+
+
 class TxIn:
-    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xFFFFFFFF):
+    __slots__ = ("prev_tx", "prev_index", "script_sig", "sequence", "witness")
+
+    def __init__(
+        self, prev_tx, prev_index, script_sig=None, sequence=0xFFFFFFFF, witness=None
+    ):
         self.prev_tx = prev_tx
         self.prev_index = prev_index
         if script_sig is None:
@@ -360,6 +1059,8 @@ class TxIn:
         else:
             self.script_sig = script_sig
         self.sequence = sequence
+        # list of witness items for segwit transactions, None otherwise
+        self.witness = witness
 
     def __repr__(self):
         return "{}:{}".format(
@@ -378,13 +1079,26 @@ class TxIn:
         sequence = little_endian_to_int(s.read(4))
         return cls(prev_tx, prev_index, script_sig, sequence)
 
+    @classmethod
+    def parse_at(cls, buf, offset):
+        """Same as parse, from a buffer at offset.
+        Returns the TxIn and the offset past it"""
+        prev_tx, prev_index = _OUTPOINT(buf, offset)
+        script_sig, offset = Script.parse_at(buf, offset + 36)
+        sequence = _UINT32(buf, offset)[0]
+        return cls(prev_tx[::-1], prev_index, script_sig, sequence), offset + 4
+
     def serialize(self):
         """Returns the byte serialization of the transaction input"""
-        result = self.prev_tx[::-1]
-        result += int_to_little_endian(self.prev_index, 4)
-        result += self.script_sig.serialize()
-        result += int_to_little_endian(self.sequence, 4)
-        return result
+        return bytes(self.serialize_into(bytearray()))
+
+    def serialize_into(self, buf):
+        """Appends the serialization to the bytearray buf and returns buf"""
+        buf += self.prev_tx[::-1]
+        buf += int_to_little_endian(self.prev_index, 4)
+        self.script_sig.serialize_into(buf)
+        buf += int_to_little_endian(self.sequence, 4)
+        return buf
 
     def fetch_tx(self, testnet=False):
         return TxFetcher.fetch(self.prev_tx.hex(), testnet=testnet)
@@ -405,6 +1119,7 @@ class TxIn:
 
 
 class TxOut:
+    __slots__ = ("amount", "script_pubkey")
 
     def __init__(self, amount, script_pubkey):
         self.amount = amount
@@ -422,8 +1137,20 @@ class TxOut:
         script_pubkey = Script.parse(s)
         return cls(amount, script_pubkey)
 
+    @classmethod
+    def parse_at(cls, buf, offset):
+        """Same as parse, from a buffer at offset.
+        Returns the TxOut and the offset past it"""
+        amount = _UINT64(buf, offset)[0]
+        script_pubkey, offset = Script.parse_at(buf, offset + 8)
+        return cls(amount, script_pubkey), offset
+
     def serialize(self):
         """Returns the byte serialization of the transaction output"""
-        result = int_to_little_endian(self.amount, 8)
-        result += self.script_pubkey.serialize()
-        return result
+        return bytes(self.serialize_into(bytearray()))
+
+    def serialize_into(self, buf):
+        """Appends the serialization to the bytearray buf and returns buf"""
+        buf += int_to_little_endian(self.amount, 8)
+        self.script_pubkey.serialize_into(buf)
+        return buf
@@ -1,6 +1,191 @@
-from tx import Tx, TxFetcher, TxIn
+from tx import LazyTx, Tx, TxFetcher, TxIn, TxOut
 import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from ecc import PrivateKey
+from helper import (
+    encode_varint,
+    hash160,
+    hash256,
+    int_to_little_endian,
+    SIGHASH_ALL,
+    SIGHASH_ANYONECANPAY,
+    SIGHASH_NONE,
+    SIGHASH_SINGLE,
+)
+from script import Script, p2pkh_script, p2wpkh_script
+
+
+def legacy_sig_hash(tx, input_index, script_code, hash_type):
+    """Straightforward legacy sighash, reserializing everything"""
+    base_type = hash_type & 0x1F
+    if base_type == SIGHASH_SINGLE and input_index >= len(tx.tx_outs):
+        return int.from_bytes(b"\x01" + b"\x00" * 31, "big")
+    if hash_type & SIGHASH_ANYONECANPAY:
+        indexes = [input_index]
+    else:
+        indexes = range(len(tx.tx_ins))
+    s = int_to_little_endian(tx.version, 4) + encode_varint(len(indexes))
+    for i in indexes:
+        tx_in = tx.tx_ins[i]
+        script_sig = None
+        sequence = tx_in.sequence
+        if i == input_index:
+            script_sig = script_code
+        elif base_type in (SIGHASH_NONE, SIGHASH_SINGLE):
+            sequence = 0
+        s += TxIn(tx_in.prev_tx, tx_in.prev_index, script_sig, sequence).serialize()
+    if base_type == SIGHASH_NONE:
+        tx_outs = []
+    elif base_type == SIGHASH_SINGLE:
+        tx_outs = [TxOut(0xFFFFFFFFFFFFFFFF, Script())] * input_index
+        tx_outs.append(tx.tx_outs[input_index])
+    else:
+        tx_outs = tx.tx_outs
+    s += encode_varint(len(tx_outs))
+    for tx_out in tx_outs:
+        s += tx_out.serialize()
+    s += int_to_little_endian(tx.locktime, 4)
+    s += int_to_little_endian(hash_type, 4)
+    return int.from_bytes(hash256(s), "big")
+
+
+def signed_tx():
+    """A transaction spending two p2pkh outputs and a 2-of-2 p2sh one,
+    signed, with the transactions it spends. Nothing comes from the network
+    as long as those are in TxFetcher's cache."""
+    keys = [PrivateKey(secret) for secret in (8675309, 5000, 2021, 4096)]
+    secs = [key.point.sec() for key in keys[2:]]
+    redeem_script = Script([0x52] + secs + [0x52, 0xAE])
+    redeem = redeem_script.raw_serialize()
+    script_pubkeys = [
+        p2pkh_script(keys[0].point.hash160()),
+        p2pkh_script(keys[1].point.hash160()),
+        Script([0xA9, hash160(redeem), 0x87]),
+    ]
+    prev_txs = [
+        Tx(1, [TxIn(bytes([i + 1]) * 32, 0)], [TxOut(5000, script_pubkey)], 0)
+        for i, script_pubkey in enumerate(script_pubkeys)
+    ]
+    tx_ins = [TxIn(prev_tx.hash(), 0) for prev_tx in prev_txs]
+    tx = Tx(1, tx_ins, [TxOut(14000, p2pkh_script(b"\x00" * 20))], 0)
+    for prev_tx in prev_txs:
+        TxFetcher.put(prev_tx.id(), prev_tx)
+    tx.sign_inputs([(0, keys[0]), (1, keys[1])])
+    z = tx.sig_hash(2, redeem_script)
+    sigs = [key.sign(z).der() + SIGHASH_ALL.to_bytes(1, "big") for key in keys[2:]]
+    tx.tx_ins[2].script_sig = Script([0] + sigs + [redeem])
+    return tx, prev_txs
+
+
+class ExplorerStandIn(BaseHTTPRequestHandler):
+    """Answers /tx/<id>/hex from the server's txs dict, like the block
+    explorer TxFetcher talks to"""
+
+    # keep-alive, so the pooled connections get reused
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        parts = self.path.strip("/").split("/")
+        raw_hex = self.server.txs.get(parts[-2]) if len(parts) >= 3 else None
+        if raw_hex is None:
+            self.send_response(404)
+            body = b"Transaction not found"
+        else:
+            self.send_response(200)
+            body = raw_hex.encode("ascii")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestTxFetcher:
+
+    def test_fetch_many(self):
+        private_key = PrivateKey(secret=8675309)
+        script_pubkey = p2pkh_script(private_key.point.hash160())
+        prev_txs = [
+            Tx(1, [TxIn(bytes([i]) * 32, 0)], [TxOut(1000 + i, script_pubkey)], 0)
+            for i in range(4)
+        ]
+        tx_ins = [TxIn(prev_tx.hash(), 0) for prev_tx in prev_txs]
+        tx = Tx(1, tx_ins, [TxOut(4000, script_pubkey)], 0)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ExplorerStandIn)
+        server.txs = {prev_tx.id(): prev_tx.serialize().hex() for prev_tx in prev_txs}
+        server.requests = []
+        serve = threading.Thread(target=server.serve_forever, args=(0.01,))
+        serve.daemon = True
+        serve.start()
+        saved = (TxFetcher.mainnet_url, TxFetcher.session, TxFetcher.cache.copy())
+        TxFetcher.mainnet_url = "http://127.0.0.1:{}/api/".format(server.server_port)
+        TxFetcher.session = None
+        try:
+            for prev_tx in prev_txs:
+                TxFetcher.cache.pop(prev_tx.id(), None)
+            tx.prefetch_prevouts()
+            assert len(server.requests) == 4
+            # everything else comes from the cache
+            assert tx.fee() == 6
+            ids = [prev_tx.id() for prev_tx in reversed(prev_txs)]
+            fetched = TxFetcher.fetch_many(ids + ids[:1])
+            assert [t.id() for t in fetched] == ids + ids[:1]
+            assert len(server.requests) == 4
+            # a transaction the explorer does not have
+            try:
+                TxFetcher.fetch("ff" * 32)
+                assert False, "expected a ValueError"
+            except ValueError:
+                pass
+            # signing one input only fetches the transaction it spends
+            for prev_tx in prev_txs:
+                TxFetcher.cache.pop(prev_tx.id(), None)
+            requests = len(server.requests)
+            assert tx.sign_inputs([(0, private_key)])
+            assert len(server.requests) == requests + 1
+            assert prev_txs[0].id() in server.requests[-1]
+        finally:
+            server.shutdown()
+            server.server_close()
+            TxFetcher.mainnet_url, TxFetcher.session, cache = saved
+            TxFetcher.cache.clear()
+            TxFetcher.cache.update(cache)
+
+    def test_lru(self):
+        raw_tx = bytes.fromhex(
+            "0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600"
+        )
+        tx = Tx.parse_bytes(raw_tx)
+        tx_id = tx.id()
+        saved = TxFetcher.cache.copy()
+        TxFetcher.clear()
+        try:
+            TxFetcher.resize(max_entries=2)
+            TxFetcher.put(tx_id, tx)
+            TxFetcher.put("11" * 32, Tx(1, [], [], 0))
+            assert TxFetcher.fetch(tx_id) is tx
+            # the least recently used one goes first
+            TxFetcher.put("22" * 32, Tx(1, [], [], 0))
+            assert list(TxFetcher.cache) == [tx_id, "22" * 32]
+            TxFetcher.put("33" * 32, Tx(1, [], [], 0))
+            assert list(TxFetcher.cache) == ["22" * 32, "33" * 32]
+            stats = TxFetcher.stats()
+            assert (stats["hits"], stats["misses"]) == (1, 0)
+            assert stats["evictions"] == 2
+            # by size: room for about one raw_tx
+            TxFetcher.put(tx_id, tx)
+            TxFetcher.resize(max_entries=10, max_bytes=5 * len(raw_tx))
+            assert list(TxFetcher.cache) == [tx_id]
+            TxFetcher.put("44" * 32, Tx(1, [], [], 0))
+            assert list(TxFetcher.cache) == ["44" * 32]
+            assert TxFetcher.stats()["bytes"] <= 5 * len(raw_tx)
+        finally:
+            TxFetcher.resize(max_entries=10000, max_bytes=None)
+            TxFetcher.clear()
+            TxFetcher.cache.update(saved)
 
 
 class TestTx:
@@ -98,6 +283,191 @@ class TestTx:
         )
         assert tx.sig_hash(0) == want
 
+    def test_sig_hash_types(self):
+        raw_tx = bytes.fromhex(
+            "010000000456919960ac691763688d3d3bcea9ad6ecaf875df5339e148a1fc61c6ed7a069e010000006a47304402204585bcdef85e6b1c6af5c2669d4830ff86e42dd205c0e089bc2a821657e951c002201024a10366077f87d6bce1f7100ad8cfa8a064b39d4e8fe4ea13a7b71aa8180f012102f0da57e85eec2934a82a585ea337ce2f4998b50ae699dd79f5880e253dafafb7feffffffeb8f51f4038dc17e6313cf831d4f02281c2a468bde0fafd37f1bf882729e7fd3000000006a47304402207899531a52d59a6de200179928ca900254a36b8dff8bb75f5f5d71b1cdc26125022008b422690b8461cb52c3cc30330b23d574351872b7c361e9aae3649071c1a7160121035d5c93d9ac96881f19ba1f686f15f009ded7c62efe85a872e6a19b43c15a2937feffffff567bf40595119d1bb8a3037c356efd56170b64cbcc160fb028fa10704b45d775000000006a47304402204c7c7818424c7f7911da6cddc59655a70af1cb5eaf17c69dadbfc74ffa0b662f02207599e08bc8023693ad4e9527dc42c34210f7a7d1d1ddfc8492b654a11e7620a0012102158b46fbdff65d0172b7989aec8850aa0dae49abfb84c81ae6e5b251a58ace5cfeffffffd63a5e6c16e620f86f375925b21cabaf736c779f88fd04dcad51d26690f7f345010000006a47304402200633ea0d3314bea0d95b3cd8dadb2ef79ea8331ffe1e61f762c0f6daea0fabde022029f23b3e9c30f080446150b23852028751635dcee2be669c2a1686a4b5edf304012103ffd6f4a67e94aba353a00882e563ff2722eb4cff0ad6006e86ee20dfe7520d55feffffff0251430f00000000001976a914ab0c0b2e98b1ab6dbf67d4750b0a56244948a87988ac005a6202000000001976a9143c82d7df364eb6c75be8c80df2b3eda8db57397088ac46430600"
+        )
+        tx = Tx.parse(io.BytesIO(raw_tx))
+        script_code = p2pkh_script(b"\x00" * 20)
+        for base_type in (SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE):
+            for hash_type in (base_type, base_type | SIGHASH_ANYONECANPAY):
+                for i in range(len(tx.tx_ins)):
+                    want = legacy_sig_hash(tx, i, script_code, hash_type)
+                    assert tx.sig_hash(i, script_code, hash_type) == want
+        # SIGHASH_SINGLE without a matching output
+        want = int.from_bytes(b"\x01" + b"\x00" * 31, "big")
+        assert want == 1 << 248
+        assert tx.sig_hash(3, script_code, SIGHASH_SINGLE) == want
+        # the cached parts follow changes to the transaction
+        tx.locktime += 1
+        want = legacy_sig_hash(tx, 1, script_code, SIGHASH_ALL)
+        assert tx.sig_hash(1, script_code) == want
+        tx.tx_ins[2].sequence = 0
+        tx.tx_outs[0] = TxOut(1000, p2pkh_script(b"\x01" * 20))
+        tx.invalidate()
+        want = legacy_sig_hash(tx, 1, script_code, SIGHASH_ALL)
+        assert tx.sig_hash(1, script_code) == want
+        # including scripts edited in place
+        tx.tx_outs[1].script_pubkey.cmds[2] = b"\x02" * 20
+        tx.invalidate()
+        want = legacy_sig_hash(tx, 1, script_code, SIGHASH_ALL)
+        assert tx.sig_hash(1, script_code) == want
+
+    def test_id_segwit(self):
+        raw_tx = bytes.fromhex(
+            "0100000000010115e180dc28a2327e687facc33f10f2a20da717e5548406f7ae8b4c811072f8560100000000ffffffff0100b4f505000000001976a9141d7cd6c75c2e86f4cbf98eaed221b30bd9a0b92888ac02483045022100df7b7e5cda14ddf91290e02ea10786e03eb11ee36ec02dd862fe9a326bbcb7fd02203f5b4496b667e6e281cc654a2da9e4f08660c620a1051337fa8965f727eb19190121038262a6c6cec93c2d3ecd6c6072efea86d02ff8e3328bbd0242b20af3425990ac00000000"
+        )
+        tx = Tx.parse(io.BytesIO(raw_tx))
+        want = "d869f854e1f8788bcff294cc83b280942a8c728de71eb709a2c29d10bfe21b7c"
+        assert tx.id() == want
+        assert tx.wtxid() == hash256(raw_tx)[::-1].hex()
+        assert tx.hash() is tx.hash()
+        # the cached hashes are dropped when the transaction changes
+        wtxid = tx.wtxid()
+        tx.tx_ins[0].witness[0] = b"\x00"
+        assert tx.wtxid() == wtxid
+        tx.invalidate()
+        assert tx.id() == want
+        assert tx.wtxid() != wtxid
+        tx.locktime = 1
+        assert tx.id() != want
+        assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+        tx.locktime = 0
+        tx.tx_outs[0].amount -= 1
+        tx.invalidate()
+        assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+        tx.segwit = False
+        assert tx.wtxid() == tx.id()
+        tx.tx_outs = tx.tx_outs[:0]
+        assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+        # scripts edited in place as well
+        for parse in (lambda raw: Tx.parse(io.BytesIO(raw)), Tx.parse_bytes):
+            tx = parse(raw_tx)
+            assert tx.id() == want
+            tx.tx_outs[0].script_pubkey.cmds[2] = b"\x00" * 20
+            tx.invalidate()
+            assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+            assert tx.id() != want
+
+    def test_parse_bytes(self):
+        legacy = bytes.fromhex(
+            "0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600"
+        )
+        segwit = bytes.fromhex(
+            "0100000000010115e180dc28a2327e687facc33f10f2a20da717e5548406f7ae8b4c811072f8560100000000ffffffff0100b4f505000000001976a9141d7cd6c75c2e86f4cbf98eaed221b30bd9a0b92888ac02483045022100df7b7e5cda14ddf91290e02ea10786e03eb11ee36ec02dd862fe9a326bbcb7fd02203f5b4496b667e6e281cc654a2da9e4f08660c620a1051337fa8965f727eb19190121038262a6c6cec93c2d3ecd6c6072efea86d02ff8e3328bbd0242b20af3425990ac00000000"
+        )
+        for raw in (legacy, segwit):
+            want = Tx.parse(io.BytesIO(raw))
+            tx = Tx.parse_bytes(raw)
+            assert tx.serialize() == raw
+            assert tx.id() == want.id()
+            assert tx.wtxid() == want.wtxid()
+        # transactions back to back, as in a block
+        buf = bytearray(legacy + segwit)
+        tx, offset = Tx.parse_at(buf, 0)
+        assert offset == len(legacy)
+        assert tx.id() == Tx.parse(io.BytesIO(legacy)).id()
+        tx, offset = Tx.parse_at(buf, offset)
+        assert offset == len(buf)
+        want = "d869f854e1f8788bcff294cc83b280942a8c728de71eb709a2c29d10bfe21b7c"
+        assert tx.id() == want
+        # the id follows changes to the parsed transaction
+        tx.tx_ins[0].sequence = 0
+        tx.invalidate()
+        assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+
+    def test_serialize_into(self):
+        legacy = bytes.fromhex(
+            "0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600"
+        )
+        segwit = bytes.fromhex(
+            "0100000000010115e180dc28a2327e687facc33f10f2a20da717e5548406f7ae8b4c811072f8560100000000ffffffff0100b4f505000000001976a9141d7cd6c75c2e86f4cbf98eaed221b30bd9a0b92888ac02483045022100df7b7e5cda14ddf91290e02ea10786e03eb11ee36ec02dd862fe9a326bbcb7fd02203f5b4496b667e6e281cc654a2da9e4f08660c620a1051337fa8965f727eb19190121038262a6c6cec93c2d3ecd6c6072efea86d02ff8e3328bbd0242b20af3425990ac00000000"
+        )
+        buf = bytearray()
+        for raw in (legacy, segwit):
+            tx = Tx.parse(io.BytesIO(raw))
+            assert tx.serialize_into(buf) is buf
+            LazyTx.parse_bytes(raw).serialize_into(buf)
+        assert buf == legacy * 2 + segwit * 2
+        tx = Tx.parse(io.BytesIO(segwit))
+        assert tx.serialize_legacy() == tx.serialize_legacy_into(bytearray())
+        assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+
+    def test_slots(self):
+        tx_in = TxIn(b"\x00" * 32, 0)
+        tx_out = TxOut(1000, p2pkh_script(b"\x00" * 20))
+        tx = Tx(1, [tx_in], [tx_out], 0, segwit=True)
+        for obj in (tx, tx_in, tx_out, tx_out.script_pubkey):
+            assert not hasattr(obj, "__dict__")
+        # an input without witness items serializes as an empty witness
+        assert tx_in.witness is None
+        assert Tx.parse_bytes(tx.serialize()).tx_ins[0].witness == []
+
+    def test_lazy(self):
+        segwit = bytes.fromhex(
+            "0100000000010115e180dc28a2327e687facc33f10f2a20da717e5548406f7ae8b4c811072f8560100000000ffffffff0100b4f505000000001976a9141d7cd6c75c2e86f4cbf98eaed221b30bd9a0b92888ac02483045022100df7b7e5cda14ddf91290e02ea10786e03eb11ee36ec02dd862fe9a326bbcb7fd02203f5b4496b667e6e281cc654a2da9e4f08660c620a1051337fa8965f727eb19190121038262a6c6cec93c2d3ecd6c6072efea86d02ff8e3328bbd0242b20af3425990ac00000000"
+        )
+        tx = LazyTx.parse_bytes(segwit)
+        want = "d869f854e1f8788bcff294cc83b280942a8c728de71eb709a2c29d10bfe21b7c"
+        assert tx.id() == want
+        assert tx.serialize() == segwit
+        assert len(tx.tx_ins) == 1
+        assert tx.tx_outs[0].amount == 99988480
+        assert tx.tx_outs[-1] is tx.tx_outs[0]
+        assert tx.tx_ins[0].witness == Tx.parse_bytes(segwit).tx_ins[0].witness
+        assert not tx.is_modified()
+        # changes to the decoded objects are picked up
+        tx.tx_outs[0].amount -= 1000
+        assert tx.is_modified()
+        eager = Tx.parse_bytes(segwit)
+        eager.tx_outs[0].amount -= 1000
+        assert tx.serialize() == eager.serialize()
+        assert tx.id() == eager.id()
+        # in-place script edits count as changes as well
+        tx = LazyTx.parse_bytes(segwit)
+        tx.tx_ins[0]
+        tx.tx_outs[0].script_pubkey.cmds[2] = b"\x00" * 20
+        assert tx.is_modified()
+        assert tx.serialize() != segwit
+        assert tx.serialize_into(bytearray()) == tx.serialize()
+        assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+
+    def test_sig_hash_bip143(self):
+        # native P2WPKH example from BIP143
+        raw_tx = bytes.fromhex(
+            "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac11000000"
+        )
+        tx = Tx.parse(io.BytesIO(raw_tx))
+        # stand-in for the previous transaction of input 1
+        h160 = bytes.fromhex("1d0f172a0ecb48aee1be1f2687d2963ae33f71a1")
+        prev_tx = Tx(1, [], [None, TxOut(600000000, p2wpkh_script(h160))], 0)
+        prev_id = tx.tx_ins[1].prev_tx.hex()
+        TxFetcher.cache[prev_id] = prev_tx
+        try:
+            want = "96b827c8483d4e9b96712b6713a7b68d6e8003a781feba36c31143470b4efd37"
+            assert tx.hash_prevouts().hex() == want
+            want = "52b0a642eea2fb7ae638c36f6252b6750293dbe574a806984b8e4d8548339a3b"
+            assert tx.hash_sequence().hex() == want
+            want = "863ef3e1a92afbfdb97f31ad0fc7683ee943e9abcf2501590ff8f6551f47e5e5"
+            assert tx.hash_outputs().hex() == want
+            want = "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670"
+            assert tx.sig_hash_bip143(1) == int(want, 16)
+            # the midstates follow changes to the transaction
+            hash_outputs = tx.hash_outputs()
+            tx.tx_outs = tx.tx_outs[:1]
+            assert tx.hash_outputs() != hash_outputs
+            hash_outputs = tx.hash_outputs()
+            tx.tx_outs[0].script_pubkey.cmds[2] = b"\x00" * 20
+            assert tx.hash_outputs() == hash_outputs
+            tx.invalidate()
+            assert tx.hash_outputs() != hash_outputs
+            hash_sequence = tx.hash_sequence()
+            tx.tx_ins[0].sequence = 0xFFFFFFFF
+            tx.invalidate()
+            assert tx.hash_sequence() != hash_sequence
+        finally:
+            del TxFetcher.cache[prev_id]
+
     def test_verify_p2pkh(self):
         tx = TxFetcher.fetch(
             "452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03"
@@ -109,6 +479,32 @@ class TestTx:
         )
         assert tx.verify()
 
+    def test_verify_batch(self):
+        tx, prev_txs = signed_tx()
+        try:
+            assert tx.verify(batch=True)
+            tx.locktime += 1
+            assert not tx.verify(batch=True)
+        finally:
+            for prev_tx in prev_txs:
+                TxFetcher.cache.pop(prev_tx.id(), None)
+
+    def test_verify_parallel(self):
+        tx, prev_txs = signed_tx()
+        try:
+            assert tx.verify()
+            assert tx.verify(workers=2)
+            assert tx.first_invalid_input(workers=2) is None
+            tx.tx_ins[1].script_sig.cmds[0] = tx.tx_ins[0].script_sig.cmds[0]
+            assert tx.first_invalid_input(workers=2) == 1
+            assert tx.first_invalid_input() == 1
+            tx.locktime += 1
+            assert tx.first_invalid_input(workers=2) == 0
+            assert tx.first_invalid_input() == 0
+        finally:
+            for prev_tx in prev_txs:
+                TxFetcher.cache.pop(prev_tx.id(), None)
+
     def test_verify_p2sh(self):
         tx = TxFetcher.fetch(
             "46df1a9484d0a81d03ce0ee543ab6e1a23ed06175c104a178268fad381216c2b"
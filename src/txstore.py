@@ -0,0 +1,180 @@
+import mmap
+import os
+import struct
+
+
+DATA_MAGIC = b"TXSTORE1"
+INDEX_MAGIC = b"TXINDEX1"
+# every record in the data file: txid, length of the raw transaction
+RECORD_HEADER = struct.Struct("<32sI")
+# index file header: magic, number of slots, used slots, data bytes indexed
+INDEX_HEADER = struct.Struct("<8sQQQ")
+# index slot: txid, offset of the raw transaction, its length (0 if free)
+INDEX_SLOT = struct.Struct("<32sQI")
+INITIAL_CAPACITY = 1024
+
+
+class TxStore:
+    """Append-only file of raw transactions keyed by txid.
+
+    The data file holds the records one after the other, so it can always
+    be replayed. Next to it, filename + '.idx' is an open-addressing hash
+    table from txid to (offset, length), at most half full. Both files are
+    memory mapped: opening the store reads two headers however many
+    transactions it holds, and a lookup touches one or two index slots
+    plus the bytes of the transaction itself.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            with open(filename, "wb") as f:
+                f.write(DATA_MAGIC)
+        self._data_file = open(filename, "r+b")
+        if self._data_file.read(len(DATA_MAGIC)) != DATA_MAGIC:
+            self._data_file.close()
+            raise ValueError("not a transaction store: {}".format(filename))
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._open_index()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, tx_id):
+        return self._find(bytes.fromhex(tx_id))[1] != 0
+
+    def get(self, tx_id):
+        """Raw bytes of the transaction as a memoryview, None if missing"""
+        _, length, offset = self._find(bytes.fromhex(tx_id))
+        if length == 0:
+            return None
+        if offset + length > len(self._data):
+            # appended after the data file was mapped. The old map is left to
+            # the garbage collector as views of it may still be in use.
+            self._data = mmap.mmap(
+                self._data_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        return memoryview(self._data)[offset : offset + length]
+
+    def add(self, tx_id, raw):
+        """Appends the raw transaction, unless the txid is already there"""
+        txid = bytes.fromhex(tx_id)
+        if self._find(txid)[1] != 0:
+            return
+        self._data_file.seek(0, os.SEEK_END)
+        offset = self._data_file.tell() + RECORD_HEADER.size
+        self._data_file.write(RECORD_HEADER.pack(txid, len(raw)))
+        self._data_file.write(raw)
+        self._data_file.flush()
+        self._insert(txid, offset, len(raw))
+        self._write_header(offset + len(raw))
+
+    def close(self):
+        self._index.flush()
+        self._index.close()
+        self._index_file.close()
+        # transactions parsed from the store may still use the data map,
+        # it goes away with the last of them
+        self._data = None
+        self._data_file.close()
+
+    def _open_index(self):
+        """Maps the index, bringing it up to date with the data file"""
+        data_size = os.path.getsize(self.filename)
+        indexed = None
+        if os.path.exists(self.index_filename):
+            index_size = os.path.getsize(self.index_filename)
+            if index_size >= INDEX_HEADER.size:
+                self._index_file = open(self.index_filename, "r+b")
+                self._index = mmap.mmap(self._index_file.fileno(), 0)
+                magic, self._capacity, self._count, indexed = INDEX_HEADER.unpack_from(
+                    self._index
+                )
+                slots_size = index_size - INDEX_HEADER.size
+                if (
+                    magic != INDEX_MAGIC
+                    or indexed > data_size
+                    or self._capacity == 0
+                    or slots_size != self._capacity * INDEX_SLOT.size
+                ):
+                    # the index does not belong to this data file, or was
+                    # cut short
+                    self._index.close()
+                    self._index_file.close()
+                    indexed = None
+        if indexed is None:
+            self._create_index(INITIAL_CAPACITY)
+            indexed = len(DATA_MAGIC)
+        # index the records appended since the index was last written
+        # (normally none)
+        self._replay(indexed, data_size)
+
+    def _replay(self, offset, end):
+        while offset + RECORD_HEADER.size <= end:
+            txid, length = RECORD_HEADER.unpack_from(self._data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > end:
+                # a record cut short by a crash, overwritten by the next add
+                offset -= RECORD_HEADER.size
+                self._data_file.truncate(offset)
+                self._data = mmap.mmap(
+                    self._data_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+                break
+            if self._find(txid)[1] == 0:
+                self._insert(txid, offset, length)
+            offset += length
+        self._write_header(offset)
+
+    def _create_index(self, capacity, slots=()):
+        """Writes a new empty index with the given number of slots, then
+        fills it with the (txid, offset, length) in slots"""
+        tmp_filename = self.index_filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            f.truncate(INDEX_HEADER.size + capacity * INDEX_SLOT.size)
+        os.replace(tmp_filename, self.index_filename)
+        self._index_file = open(self.index_filename, "r+b")
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        self._capacity = capacity
+        self._count = 0
+        for txid, offset, length in slots:
+            self._insert(txid, offset, length)
+
+    def _write_header(self, indexed):
+        INDEX_HEADER.pack_into(
+            self._index, 0, INDEX_MAGIC, self._capacity, self._count, indexed
+        )
+
+    def _find(self, txid):
+        """Returns (slot, length, offset) of the txid, or the free slot
+        where it would go with a length of 0"""
+        # txids are hashes already, so their first bytes are well spread
+        slot = int.from_bytes(txid[:8], "little") % self._capacity
+        while True:
+            position = INDEX_HEADER.size + slot * INDEX_SLOT.size
+            found, offset, length = INDEX_SLOT.unpack_from(self._index, position)
+            if length == 0 or found == txid:
+                return slot, length, offset
+            slot = (slot + 1) % self._capacity
+
+    def _insert(self, txid, offset, length):
+        if 2 * (self._count + 1) > self._capacity:
+            self._grow()
+        slot = self._find(txid)[0]
+        position = INDEX_HEADER.size + slot * INDEX_SLOT.size
+        INDEX_SLOT.pack_into(self._index, position, txid, offset, length)
+        self._count += 1
+
+    def _grow(self):
+        slots = []
+        for slot in range(self._capacity):
+            position = INDEX_HEADER.size + slot * INDEX_SLOT.size
+            txid, offset, length = INDEX_SLOT.unpack_from(self._index, position)
+            if length != 0:
+                slots.append((txid, offset, length))
+        _, _, _, indexed = INDEX_HEADER.unpack_from(self._index)
+        self._index.close()
+        self._index_file.close()
+        self._create_index(self._capacity * 2, slots)
+        self._write_header(indexed)
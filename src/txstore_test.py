@@ -0,0 +1,114 @@
+import os
+import tempfile
+
+from txstore import INITIAL_CAPACITY, RECORD_HEADER, TxStore
+from tx import LazyTx, Tx, TxFetcher
+
+
+RAW_TX = bytes.fromhex(
+    "0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600"
+)
+
+
+def fake_entries(count):
+    """count distinct (tx_id, raw) pairs, not real transactions"""
+    return [(i.to_bytes(32, "little").hex(), i.to_bytes(8, "big")) for i in range(count)]
+
+
+class TestTxStore:
+
+    def test_add_get(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "tx.store")
+            store = TxStore(filename)
+            entries = fake_entries(INITIAL_CAPACITY)  # makes the index grow
+            for tx_id, raw in entries:
+                store.add(tx_id, raw)
+            store.add(*entries[0])  # already there
+            assert len(store) == len(entries)
+            assert store.get("00" * 31 + "ff") is None
+            store.close()
+            # everything is still there when opened again
+            store = TxStore(filename)
+            assert len(store) == len(entries)
+            for tx_id, raw in entries:
+                assert tx_id in store
+                assert store.get(tx_id) == raw
+            store.close()
+
+    def test_recover(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "tx.store")
+            entries = fake_entries(3)
+            store = TxStore(filename)
+            store.add(*entries[0])
+            store.close()
+            # records the index has not seen, the last one cut short
+            with open(filename, "ab") as f:
+                f.write(RECORD_HEADER.pack(bytes.fromhex(entries[1][0]), 8))
+                f.write(entries[1][1])
+                f.write(RECORD_HEADER.pack(bytes.fromhex(entries[2][0]), 8))
+                f.write(entries[2][1][:3])
+            store = TxStore(filename)
+            assert len(store) == 2
+            assert store.get(entries[1][0]) == entries[1][1]
+            assert entries[2][0] not in store
+            store.add(*entries[2])
+            store.close()
+            # a lost index is rebuilt from the data file
+            os.remove(filename + ".idx")
+            store = TxStore(filename)
+            assert [store.get(tx_id) for tx_id, _ in entries] == [
+                raw for _, raw in entries
+            ]
+            store.close()
+            # and so is an empty or truncated one
+            for size in (0, 20, 100):
+                with open(filename + ".idx", "r+b") as f:
+                    f.truncate(size)
+                store = TxStore(filename)
+                assert [store.get(tx_id) for tx_id, _ in entries] == [
+                    raw for _, raw in entries
+                ]
+                store.close()
+
+    def test_fetcher_spill(self):
+        tx = Tx.parse_bytes(RAW_TX)
+        tx_id = tx.id()
+        saved = TxFetcher.cache.copy()
+        TxFetcher.clear()
+        with tempfile.TemporaryDirectory() as d:
+            store = TxFetcher.open_store(os.path.join(d, "tx.store"))
+            try:
+                TxFetcher.resize(max_entries=1)
+                TxFetcher.put(tx_id, tx)
+                # not a real transaction for this id, so never spilled
+                TxFetcher.put("11" * 32, Tx(1, [], [], 0))
+                TxFetcher.put("22" * 32, Tx(1, [], [], 0))
+                assert tx_id not in TxFetcher.cache
+                assert len(store) == 1
+                # the evicted transaction comes back from the store
+                assert TxFetcher.fetch(tx_id).serialize() == RAW_TX
+                assert TxFetcher.stats()["misses"] == 1
+            finally:
+                TxFetcher.resize(max_entries=10000, max_bytes=None)
+                TxFetcher.clear()
+                TxFetcher.cache.update(saved)
+                store.close()
+                TxFetcher.store = None
+
+    def test_fetch(self):
+        tx_id = Tx.parse_bytes(RAW_TX).id()
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "tx.store")
+            TxFetcher.open_store(filename).add(tx_id, RAW_TX)
+            try:
+                TxFetcher.cache.pop(tx_id, None)
+                tx = TxFetcher.fetch(tx_id)
+                assert isinstance(tx, LazyTx)
+                assert tx.id() == tx_id
+                assert tx.serialize() == RAW_TX
+            finally:
+                TxFetcher.cache.pop(tx_id, None)
+                TxFetcher.store.close()
+                TxFetcher.store = None